@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the schema file parser used by the auto migration.
+
+    python benchmarks/bench_ddl_parser.py --tables 400 --repeat 5
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+
+from kb_tools.database import DataManager
+
+_TYPES = (
+    "integer", "varchar(50)", "text", "numeric(10,2)", "boolean",
+    "timestamp", "date", "bigint", "real", "jsonb",
+)
+_DEFAULTS = ("0", "'a, b'", "now()", "'x'", "(1 + 2)")
+
+
+def generate_schema(tables=400, seed=1):
+    rand = random.Random(seed)
+    script = []
+    for t in range(tables):
+        comment = (
+            " -- previous_name: old_t%d" % t if rand.random() < 0.2 else ""
+        )
+        lines = ["CREATE TABLE IF NOT EXISTS t%d (%s" % (t, comment)]
+        columns = [("    id SERIAL PRIMARY KEY", "")]
+        for c in range(rand.randint(3, 20)):
+            extra = ""
+            if rand.random() < 0.3:
+                extra += " NOT NULL"
+            if rand.random() < 0.3:
+                extra += " DEFAULT " + rand.choice(_DEFAULTS)
+            comment = (
+                "  -- prev_name: old_c%d" % c if rand.random() < 0.2 else ""
+            )
+            columns.append(
+                ("    c%d_%d %s%s" % (t, c, rand.choice(_TYPES), extra),
+                 comment)
+            )
+        for i, (column, comment) in enumerate(columns):
+            lines.append(
+                column + ("," if i < len(columns) - 1 else "") + comment
+            )
+        lines.append(");")
+        if rand.random() < 0.3:
+            lines.append("/* block\n comment */")
+        script.append("\n".join(lines))
+    return "\n".join(script)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tables", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sgbd-name", default="postgresdb")
+    args = parser.parse_args()
+
+    script = generate_schema(args.tables)
+    timings = []
+    schema = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        schema = DataManager._parse_sql_db_creation_script(
+            script, sgbd_name=args.sgbd_name
+        )
+        timings.append(time.perf_counter() - start)
+    nb_columns = sum(len(t["columns"]) for t in schema.values())
+    print(
+        "%d tables, %d columns, %d bytes: best %.4fs, mean %.4fs" % (
+            len(schema), nb_columns, len(script), min(timings),
+            sum(timings) / len(timings)
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the conversion of the insert_many buffers in parameters.
+
+    python benchmarks/bench_insert_params.py --rows 200000 --buffer 2000
+"""
+from __future__ import annotations
+
+import argparse
+import time
+import tracemalloc
+
+import numpy
+import pandas
+
+from kb_tools.utils.fdataset import DatasetFactory
+
+
+def generate_dataset(rows=200000, seed=1):
+    rand = numpy.random.default_rng(seed)
+    amount = rand.random(rows) * 1000
+    amount[rand.random(rows) < 0.1] = numpy.nan
+    names = pandas.Series(rand.integers(0, 5000, rows)).map("client {}".format)
+    names[rand.random(rows) < 0.1] = None
+    dates = pandas.Series(
+        pandas.to_datetime("2020-01-01") +
+        pandas.to_timedelta(rand.integers(0, 1000, rows), unit="D")
+    )
+    dates[rand.random(rows) < 0.1] = pandas.NaT
+    return pandas.DataFrame({
+        "id": numpy.arange(rows),
+        "name": names,
+        "amount": amount,
+        "active": rand.random(rows) < 0.5,
+        "created_at": dates,
+    })
+
+
+def legacy_params(buffer):
+    # the conversion made by insert_many before the column wise one
+    buffer = (
+        buffer.astype(object)
+        .where(pandas.notnull(buffer), None)
+        .to_dict("records")
+    )
+    return [
+        {k: v if not pandas.isnull(v) else None for k, v in row.items()}
+        for row in buffer
+    ]
+
+
+def run(convert, dataset, buffer_size):
+    tracemalloc.start()
+    start = time.perf_counter()
+    nb = 0
+    for buffer in DatasetFactory.iter_chunks(dataset, chunksize=buffer_size):
+        nb += len(convert(buffer))
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return nb, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--buffer", type=int, default=2000)
+    args = parser.parse_args()
+
+    dataset = generate_dataset(args.rows)
+    results = {}
+    for name, convert in (
+            ("legacy", legacy_params),
+            ("to_rows", DatasetFactory.to_rows),
+    ):
+        nb, elapsed, peak = run(convert, dataset, args.buffer)
+        results[name] = elapsed
+        print(
+            "%-8s %d rows: %.3fs, %.0f rows/s, peak %.1f MB" % (
+                name, nb, elapsed, nb / elapsed, peak / 1e6
+            )
+        )
+    print("speedup: x%.1f" % (results["legacy"] / results["to_rows"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the text functions applied on columns: by value (like
+.apply) against the *_series functions (once by distinct value).
+
+    python benchmarks/bench_text.py --rows 1000000 --distinct 50000
+"""
+from __future__ import annotations
+
+import argparse
+import functools
+import random
+import time
+
+import pandas
+
+from kb_tools import tools
+
+
+def generate_columns(rows, distinct, seed=1):
+    rand = random.Random(seed)
+    first = ["Élodie", "François", "Amédée", "Zoé", "Kouassi", "Aïcha"]
+    last = ["Koné", "N'Guessan", "Brou", "Lefèvre", "Traoré", "Bamba"]
+    names = [
+        "%s %s %d" % (rand.choice(first), rand.choice(last), i)
+        for i in range(distinct)
+    ]
+    emails = [
+        tools.remove_accent_from_text(n).lower().replace(" ", ".") +
+        rand.choice(("@mail.com", "@mail", "@@x.ci", "@ent.co.ci"))
+        for n in names
+    ]
+    phones = [
+        rand.choice(("", "+225", "00225", "(225)")) + rand.choice(
+            ("07", "05", "01", "09")
+        ) + "".join(rand.choice("0123456789") for _ in range(8))
+        for _ in range(distinct)
+    ]
+    return {
+        name: pandas.Series([rand.choice(values) for _ in range(rows)])
+        for name, values in (
+            ("names", names), ("emails", emails), ("phones", phones)
+        )
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--distinct", type=int, default=50000)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    columns = generate_columns(args.rows, args.distinct)
+    cases = (
+        ("remove_accent", "names", tools.remove_accent_from_text,
+         tools.remove_accent_from_text_series),
+        ("format_var_name", "names",
+         functools.partial(tools.format_var_name, remove_accent=True),
+         functools.partial(tools.format_var_name_series,
+                           remove_accent=True)),
+        ("is_email", "emails", tools.is_email, tools.is_email_series),
+        ("is_phone_number", "phones", tools.is_phone_number,
+         tools.is_phone_number_series),
+    )
+    print("%d rows, %d distinct values" % (args.rows, args.distinct))
+    for name, column, scalar, batch in cases:
+        values = columns[column]
+        start = time.perf_counter()
+        expected = [scalar(v) for v in values]
+        by_value = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = batch(values, processes=args.processes)
+        by_distinct = time.perf_counter() - start
+        assert result.tolist() == expected, name
+        print(
+            "%-16s by value %.3fs, by distinct value %.3fs: x%.1f" % (
+                name, by_value, by_distinct, by_value / by_distinct
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the Var comparisons (Cdict keys, column matching).
+
+    python benchmarks/bench_var.py --names 200 --loops 20
+
+The "no cache" run calls the normalization without its LRU caches, like
+before they were added.
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+
+from kb_tools import tools
+
+
+def generate_names(count, seed=1):
+    rand = random.Random(seed)
+    words = [
+        "montant", "Total", "client", "Nom", "date", "création", "id",
+        "numéro", "téléphone", "adresse", "ville", "code", "postal",
+    ]
+    return [
+        rand.choice(("_", " ", "")).join(
+            rand.choice(words) for _ in range(rand.randint(1, 3))
+        )
+        for _ in range(count)
+    ]
+
+
+def run(names, loops):
+    # what the column matching does: each name against all the others
+    start = time.perf_counter()
+    nb = 0
+    for _ in range(loops):
+        variables = [tools.Var(name) for name in names]
+        for var in variables:
+            for name in names:
+                var == name
+                nb += 1
+    return nb, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--names", type=int, default=200)
+    parser.add_argument("--loops", type=int, default=20)
+    args = parser.parse_args()
+
+    names = generate_names(args.names)
+    cached = tools._format_var_name, tools._var_key
+    results = {}
+    try:
+        for name, funcs in (
+                ("no cache", tuple(f.__wrapped__ for f in cached)),
+                ("cache", cached),
+        ):
+            tools._format_var_name, tools._var_key = funcs
+            nb, elapsed = run(names, args.loops)
+            results[name] = elapsed
+            print(
+                "%-8s %d comparisons: %.3fs, %.0f comparisons/s" % (
+                    name, nb, elapsed, nb / elapsed
+                )
+            )
+    finally:
+        tools._format_var_name, tools._var_key = cached
+    print("speedup: x%.1f" % (results["no cache"] / results["cache"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,13 @@
 from __future__ import annotations
 
 import abc
+import contextlib
 import csv
 import decimal
 import os
+import re
+import threading
+import time
 
 import pandas
 
@@ -18,15 +22,35 @@ except ImportError:
         return (x for x in iter_obj)
 
 
-from kb_tools.tools import INFINITE, Cdict, get_buffer, get_no_filepath
+from kb_tools.database.coercion import CoercionPlan
+from kb_tools.database.replicas import ReplicaRouter, is_read_only
+from kb_tools.tools import (
+    INFINITE, Cdict, Row, RowFields, get_no_filepath, prefetch
+)
 from kb_tools.utils.fdataset import DatasetFactory
 
+_migration_lock = threading.RLock()
+
+# statements which may change the table columns
+_ddl_reg = re.compile(r"\b(?:create|alter|drop|rename)\b", re.I)
+
 
 class BaseDB(abc.ABC):
     DEFAULT_PORT = None
     MAX_BUFFER_INSERTING_SIZE = 2000
+    # buffers read in advance by insert_many
+    PREFETCH_BUFFERS = 2
+    # convert the insert_many data to the table column types
+    COERCE_TYPES = True
+    # class of the dict_res rows: Cdict, or Row for lighter rows (tuple
+    # backed, not dicts, no new key)
+    ROW_CLASS = Cdict
     LAST_REQUEST_COLUMNS = None
     LAST_ROW_COUNT = None
+    MIGRATION_TABLE = "kb_tools_schema_version"
+    # the uri query args given to the driver as kwargs (as str), the
+    # others are ignored
+    URI_QUERY_ARGS = ()
 
     def __init__(self, **kwargs):
         self._kwargs = kwargs
@@ -38,6 +62,9 @@ class BaseDB(abc.ABC):
         self.db_object = None
         self._cursor_ = None
         self.auto_commit = kwargs.get("auto_commit", True)
+        self._router = None
+        # table name -> CoercionPlan, see _coercion_plan
+        self._coercion_plans = {}
 
     @property
     def log_info(self):
@@ -74,6 +101,22 @@ class BaseDB(abc.ABC):
         """
         pass
 
+    @property
+    def get_indexes(self):
+        """
+        The indexes not created by a constraint (primary key, unique)
+
+        Returns:
+            list of indexes like:
+                {
+                    "indexName": "index",
+                    "tableName": "table",
+                    "definition": "CREATE INDEX index ON table (column)",
+                    "valid": 1
+                }
+        """
+        return []
+
     @staticmethod
     @abc.abstractmethod
     def dict_params(k):
@@ -95,6 +138,41 @@ class BaseDB(abc.ABC):
             self._print_error = logger.exception
         self._kwargs["logger"] = logger
 
+    def set_replicas(
+            self, replicas, strategy="round_robin", sticky_after_write=0.0
+    ):
+        """
+        Send the read only requests of run_script/run_as_batch to the
+        replicas. The writes and the requests run when auto_commit is
+        disabled (inside a transaction) stay on this database.
+        Args:
+            replicas: list of BaseDB objects, None to disable the routing
+            strategy: str, round_robin or least_latency
+            sticky_after_write: float, number of seconds after a write
+                during which the reads also go to this database
+
+        Returns: None
+        """
+        if self._router is not None:
+            self._router.close()
+        self._router = None
+        if replicas:
+            self._router = ReplicaRouter(
+                replicas, strategy=strategy,
+                sticky_after_write=sticky_after_write
+            )
+
+    def _route_read(self, script):
+        router = self._router
+        if router is None:
+            return None
+        if not is_read_only(script):
+            router.mark_write()
+            return None
+        if not self.auto_commit or router.in_sticky_window():
+            return None
+        return router.pick()
+
     def __call__(self, *args, **kwargs):
         return self._cursor()
 
@@ -203,6 +281,13 @@ class BaseDB(abc.ABC):
     def _check_if_cursor_has_rows(*_, **__):
         return True
 
+    def cancel(self):
+        """
+        Cancel the request currently running on the connection, from
+        another thread. Does nothing when the driver doesn't allow it.
+        """
+        pass
+
     def commit(self):
         try:
             self.db_object.commit()
@@ -216,6 +301,26 @@ class BaseDB(abc.ABC):
         except (Exception, AttributeError):
             pass
 
+    @contextlib.contextmanager
+    def no_transaction(self):
+        """
+        Run the statements which can't be run inside a transaction block
+        (like CREATE INDEX CONCURRENTLY). The current transaction is
+        committed first.
+        """
+        self.commit()
+        yield
+
+    @contextlib.contextmanager
+    def migration_lock(self):
+        """
+        Lock held while the schema is migrated, so that concurrent
+        starters don't migrate the same database at the same time.
+        The default lock only works inside the current process.
+        """
+        with _migration_lock:
+            yield
+
     @staticmethod
     def _remove_quoting_element(script, _quotes_list=('"', "'")):
         ss = ""
@@ -308,6 +413,8 @@ class BaseDB(abc.ABC):
         return cursor
 
     def insert(self, value: dict, table_name, cur=None, retrieve_id=False):
+        if self._router is not None:
+            self._router.mark_write()
         part_vars = [str(k) for k in value.keys()]
 
         xx, value = self.prepare_insert_data(value)
@@ -347,63 +454,128 @@ class BaseDB(abc.ABC):
     def insert_many(
             self, data: list | pandas.DataFrame | str, table_name, **kwargs
     ):
+        """
+        Insert the rows of data in table_name by buffers of
+        MAX_BUFFER_INSERTING_SIZE rows. The csv and JSON Lines files and
+        the iterators are streamed (see DatasetFactory.iter_chunks). For
+        the files (path or readable object), the next buffer is read while
+        the current one is inserted; the iterators are read in the calling
+        thread since they may use a connection of this thread.
+        The values are converted to the types of the table columns (see
+        CoercionPlan) unless coerce_types=False is given. A ValueError is
+        raised before sending anything when the data doesn't match them
+        (before sending the buffer and after a rollback for the streamed
+        data). Any error while reading the streamed data rolls back the
+        buffers already inserted.
+        """
+        if self._router is not None:
+            self._router.mark_write()
+
+        plan = None
+        if kwargs.pop("coerce_types", self.COERCE_TYPES):
+            plan = self._coercion_plan(table_name)
+        if plan is not None and not DatasetFactory.is_streamed(data):
+            # the whole data is converted (and checked) at once
+            data = plan.apply(DatasetFactory(data, **kwargs).dataset)
+            kwargs = {}
+            plan = None
 
         cursor = self.get_cursor()
-        dataset = DatasetFactory(data, **kwargs).dataset.reset_index(drop=True)
-        size = dataset.shape[0]
-        if not size:
-            return
+        chunks = DatasetFactory.iter_chunks(
+            data, chunksize=self.MAX_BUFFER_INSERTING_SIZE, **kwargs
+        )
+        if isinstance(data, str) or (
+                hasattr(data, "readable") and data.readable()
+        ):
+            chunks = prefetch(chunks, size=self.PREFETCH_BUFFERS)
+        script = None
+        try:
+            for buffer in tqdm(chunks):
+                if not buffer.shape[0]:
+                    continue
+                if plan is not None:
+                    buffer = plan.apply(buffer)
+                if script is None:
+                    first_value = buffer.iloc[0].to_dict()
+                    part_vars = [str(k) for k in first_value.keys()]
+
+                    xx, _ = self.prepare_insert_data(first_value)
+                    script = (
+                            "INSERT INTO "
+                            + str(table_name)  # nosec
+                            + " ( "
+                            + ",".join(part_vars)  # nosec
+                            + ") VALUES ( "
+                            + ", ".join(xx)  # nosec
+                            + " ) "
+                    )
+                try:
+                    self.execute(
+                        cursor,
+                        script,
+                        params=DatasetFactory.to_rows(buffer),
+                        method="many",
+                    )
+                except Exception as ex:
+
+                    self._print_error(
+                        "\n", "->Got error with the buffer: ", buffer
+                    )
+                    DatasetFactory(buffer).dataset.to_csv(
+                        "error.csv", index=False
+                    )
 
-        first_value = dataset.loc[dataset.index[0]].to_dict()
-        part_vars = [str(k) for k in first_value.keys()]
+                    self._print_error(ex)
+                    return
+        except Exception:
+            # reading or converting the data failed: don't keep the
+            # buffers already inserted
+            self.rollback()
+            raise
+        if script is not None and self.auto_commit:
+            self.commit()
 
-        xx, _ = self.prepare_insert_data(first_value)
+    def _coercion_plan(self, table_name):
+        """
+        The CoercionPlan of the table, cached until run_script runs a
+        statement which may change the columns (CREATE, ALTER, ...)
+        """
+        key = str(table_name).lower()
+        plan = self._coercion_plans.get(key)
+        if plan is None:
+            plan = CoercionPlan.from_db(self, table_name)
+            if plan is not None:
+                self._coercion_plans[key] = plan
+        return plan
+
+    def bulk_insert(self, table_name, columns, rows, cursor=None):
+        """
+        Insert the rows (sequences of values in the columns order) with the
+        fastest way of the driver, without commit
+        Args:
+            table_name: str
+            columns: list of column names
+            rows: list of tuples
+            cursor: the cursor to use
+
+        Returns: the number of rows inserted
+        """
+        if not rows:
+            return 0
+        xx, _ = self.prepare_insert_data(dict.fromkeys(columns))
         script = (
                 "INSERT INTO "
                 + str(table_name)  # nosec
                 + " ( "
-                + ",".join(part_vars)  # nosec
+                + ",".join(str(c) for c in columns)  # nosec
                 + ") VALUES ( "
                 + ", ".join(xx)  # nosec
                 + " ) "
         )
-        total_tqdm = int(dataset.shape[0] / self.MAX_BUFFER_INSERTING_SIZE) + 2
-        for t, buffer in tqdm(
-                get_buffer(dataset, max_buffer=self.MAX_BUFFER_INSERTING_SIZE),
-                total=total_tqdm,
-        ):
-            # print(buffer)
-            buffer = (
-                buffer.astype(object)
-                .where(pandas.notnull(buffer), None)
-                .to_dict("records")
-            )
-            # buffer = buffer.astype(object).
-            # replace(DatasetFactory.NAN, None).to_dict("records")
-            try:
-                self.execute(
-                    cursor,
-                    script,
-                    params=[
-                        {
-                            k: v if not pandas.isnull(v) else None
-                            for k, v in row.items()
-                        }
-                        for row in buffer
-                    ],
-                    method="many",
-                )
-            except Exception as ex:
-
-                self._print_error(
-                    "\n", "->Got error with the buffer: ", buffer
-                )
-                DatasetFactory(buffer).dataset.to_csv("error.csv", index=False)
-
-                self._print_error(ex)
-                return
-        if self.auto_commit:
-            self.commit()
+        self.execute(
+            cursor or self.get_cursor(), script, params=rows, method="many"
+        )
+        return len(rows)
 
     @staticmethod
     def prepare_insert_data(data):
@@ -424,6 +596,13 @@ class BaseDB(abc.ABC):
     def _get_cursor_description(cursor):
         ...  # noqa: E704
 
+    def _row_factory(self, columns):
+        """Get the function building the dict_res rows of a result"""
+        if self.ROW_CLASS is Row:
+            fields = RowFields(columns)
+            return lambda values: Row(fields, values)
+        return lambda values: self.ROW_CLASS(dict(zip(columns, values)))
+
     def get_all_data_from_cursor(
             self, cursor, limit=INFINITE, dict_res=False, export_name=None,
             sep=";"
@@ -456,6 +635,9 @@ class BaseDB(abc.ABC):
                     writer = csv.writer(export_file, delimiter=sep)
                     writer.writerow(columns)
 
+                make_row = None
+                if dict_res and export_name is None:
+                    make_row = self._row_factory(columns)
                 for row in self._fetchone(cursor, limit=limit):
                     if not row:
                         break
@@ -470,8 +652,8 @@ class BaseDB(abc.ABC):
                                 for f in row
                             ]
                         )
-                    if dict_res and export_name is None:
-                        row = dict(zip(columns, row))
+                    if make_row is not None:
+                        row = make_row(row)
                     if callable(export_name):
                         export_name(row, columns)
                     elif export_name is not None:
@@ -497,6 +679,7 @@ class BaseDB(abc.ABC):
             ignore_error=False,
             dict_res=False,
             batch_size=None,
+            primary=False,
     ):
         batch_size = int(batch_size or self.MAX_BUFFER_INSERTING_SIZE)
         cursor = self.run_script(
@@ -506,6 +689,7 @@ class BaseDB(abc.ABC):
             limit=batch_size,
             ignore_error=ignore_error,
             dict_res=dict_res,
+            primary=primary,
             _for_batch=True,
         )
         size = 0
@@ -521,6 +705,27 @@ class BaseDB(abc.ABC):
             yield data
         return
 
+    def _stream_batches(self, script, params=None, batch_size=None):
+        """
+        Read the result of the request by batches of raw rows (the driver
+        values, like Decimal, are kept), used by transfer
+        Returns:
+            generator of (description, rows): the rows of the first batch
+            can be empty, description is the _get_cursor_description of
+            the request
+        """
+        batch_size = int(batch_size or self.MAX_BUFFER_INSERTING_SIZE)
+        cursor = self.run_script(
+            script, params=params, retrieve=False, _for_batch=True
+        )
+        description = self._get_cursor_description(cursor)
+        rows = cursor.fetchmany(batch_size)
+        yield description, rows
+        while rows:
+            rows = cursor.fetchmany(batch_size)
+            if rows:
+                yield description, rows
+
     def run_script(
             self,
             script,
@@ -533,14 +738,37 @@ class BaseDB(abc.ABC):
             export=False,
             export_name=None,
             sep=";",
+            primary=False,
             _for_batch=False,
     ):
+        # primary=True: never sent to a replica (like the requests calling
+        # functions which write, or which must see the primary state)
         try:
             assert os.path.exists(script)
             with open(script) as file:
                 script = file.read().strip()
         except (AssertionError, OSError, Exception):
             pass
+        if self._coercion_plans and _ddl_reg.search(str(script)):
+            self._coercion_plans.clear()
+        replica = None if primary else self._route_read(script)
+        if replica is not None:
+            start = time.perf_counter()
+            try:
+                res = replica.run_script(
+                    script, params=params, retrieve=retrieve, limit=limit,
+                    ignore_error=False, dict_res=dict_res, export=export,
+                    export_name=export_name, sep=sep, _for_batch=_for_batch
+                )
+            except Exception as ex:  # noqa
+                self.log_warning(
+                    "Replica request failed, use the primary: %s" % ex
+                )
+            else:
+                self._router.record(replica, time.perf_counter() - start)
+                self.LAST_REQUEST_COLUMNS = replica.LAST_REQUEST_COLUMNS
+                self.LAST_ROW_COUNT = replica.LAST_ROW_COUNT
+                return res
         if limit is None:
             limit = INFINITE
         if not self._is_connected():
@@ -589,10 +817,6 @@ class BaseDB(abc.ABC):
             )
             if export_name is not None:
                 return export_name
-            if dict_res:
-                if limit == 1:
-                    return Cdict(data)
-                return [Cdict(d) for d in data]
             return data
 
 
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Conversion of the inserted data to the types of the target table columns
+"""
+from __future__ import annotations
+
+import decimal
+import json
+import re
+
+import numpy
+import pandas
+
+_true_values = {"true", "t", "yes", "y", "1", "on"}
+_false_values = {"false", "f", "no", "n", "0", "off"}
+
+# declared type (without size, precision and unsigned) -> kind of value
+_kinds = {
+    "boolean": ("bool", "boolean"),
+    "datetime": (
+        "timestamp", "timestamptz", "timestamp with time zone",
+        "timestamp without time zone", "datetime", "datetime2",
+        "smalldatetime", "datetimeoffset"
+    ),
+    "date": ("date",),
+    "time": (
+        "time", "timetz", "time with time zone", "time without time zone"
+    ),
+    "json": ("json", "jsonb"),
+    "integer": (
+        "int", "integer", "int2", "int4", "int8", "smallint", "bigint",
+        "tinyint", "mediumint", "big int", "serial", "smallserial",
+        "bigserial", "serial2", "serial4", "serial8"
+    ),
+    "text": (
+        "text", "char", "character", "varchar", "character varying",
+        "varying character", "nchar", "native character", "nvarchar",
+        "bpchar", "citext", "clob", "tinytext", "mediumtext", "longtext",
+        "uuid"
+    ),
+    "float": (
+        "real", "float", "float4", "float8", "double", "double precision"
+    ),
+    "decimal": ("numeric", "decimal", "money"),
+    "bytes": (
+        "blob", "bytea", "binary", "varbinary", "tinyblob", "mediumblob",
+        "longblob"
+    ),
+}
+_type_kinds = {t: kind for kind, types in _kinds.items() for t in types}
+
+
+def column_kind(column_type):
+    """
+    Get the kind of value stored by a column from its declared type:
+    integer, float, decimal, boolean, datetime, date, time, text, json,
+    bytes or None when the type is unknown (no coercion)
+    """
+    column_type = re.sub(r"\(.*?\)", " ", str(column_type or "").lower())
+    column_type = " ".join(
+        w for w in column_type.split()
+        if w not in ("unsigned", "signed", "zerofill")
+    )
+    return _type_kinds.get(column_type)
+
+
+class CoercionPlan:
+    """
+    How to convert each column of the inserted data, built once from the
+    schema of the target table and applied column by column on each
+    buffer.
+    Args:
+        columns: list of get_schema rows of the table
+        sgbd_name: str, the driver module name (postgresdb, sqlitedb, ...)
+    """
+
+    def __init__(self, columns, sgbd_name="postgresdb"):
+        self.sgbd_name = sgbd_name
+        self.columns = {}
+        for column in columns:
+            name = str(column["columnName"])
+            self.columns[name.lower()] = {
+                "name": name,
+                "type": str(column["type"] or ""),
+                "kind": column_kind(column["type"]),
+                # the sqlite integer primary key is the rowid: NULL is
+                # replaced by the next id
+                "nullable": bool(int(column["nullable"] or 0)) or (
+                    self.sgbd_name == "sqlitedb" and
+                    bool(int(column["is_primary_key"] or 0)) and
+                    column_kind(column["type"]) == "integer"
+                ),
+            }
+
+    @classmethod
+    def from_db(cls, db_object, table_name):
+        """
+        Build the plan of the table table_name of db_object, None if the
+        table is not found
+        """
+        table_name = str(table_name).split(".")[-1].strip('"`[]').lower()
+        columns = [
+            c for c in db_object.get_schema or []
+            if str(c["tableName"]).lower() == table_name
+        ]
+        if not columns:
+            return None
+        return cls(columns, db_object.__class__.__module__.split(".")[-1])
+
+    def apply(self, dataset: pandas.DataFrame):
+        """
+        Convert dataset to the table types
+
+        Raises:
+            ValueError: with all the columns whose values can't be inserted
+        """
+        errors = []
+        result = {}
+        for name, column in dataset.items():
+            spec = self.columns.get(str(name).lower())
+            if spec is None:
+                errors.append("%s: no such column in the table" % name)
+                continue
+            null = column.isna()
+            if not spec["nullable"] and null.any():
+                errors.append(
+                    "%s: %d null values for a NOT NULL column" % (
+                        name, int(null.sum())
+                    )
+                )
+                continue
+            try:
+                result[name] = self._convert(column, null, spec)
+            except ValueError as ex:
+                errors.append("%s (%s): %s" % (name, spec["type"], ex))
+        if errors:
+            raise ValueError(
+                "Data not matching the table types:\n    " +
+                "\n    ".join(errors)
+            )
+        return pandas.DataFrame(result, index=dataset.index)
+
+    def _convert(self, column: pandas.Series, null, spec):
+        kind = spec["kind"]
+        dtype = column.dtype
+        is_numpy = isinstance(dtype, numpy.dtype)
+        if kind is None or not (~null).any():
+            return column
+        if kind in ("integer", "float", "decimal"):
+            if dtype.kind == "M":
+                raise ValueError("datetime values given")
+            if dtype.kind == "b":
+                column = column.astype(int)
+            elif kind == "integer" and (not is_numpy or dtype.kind == "O"):
+                # value by value: a float conversion would change the big
+                # integers
+                return _to_integer(column, null)
+            elif not is_numpy or dtype.kind not in "iuf":
+                if kind == "decimal" and self.sgbd_name != "sqlitedb":
+                    # keep the exact values (Decimal, str): only check them
+                    _check_numeric(column, null)
+                    return column
+                column = _check_numeric(column, null)
+            if kind == "integer" and column.dtype.kind == "f":
+                values = column[~null]
+                if (values % 1 != 0).any():
+                    raise ValueError(
+                        "decimal values like %r given" %
+                        values[values % 1 != 0].tolist()[0]
+                    )
+                if null.any():
+                    return column.astype("Int64")
+                return column.astype("int64")
+            if kind == "float" and column.dtype.kind in "iu":
+                return column.astype(float)
+            return column
+        if kind == "boolean":
+            if is_numpy and dtype.kind == "b":
+                return column
+            values = column[~null]
+            if is_numpy and dtype.kind in "iuf":
+                values = values.astype(float).map({1.0: "1", 0.0: "0"})
+            else:
+                values = values.map(_bool_text)
+            values = values.astype(str).str.strip().str.lower()
+            bad = ~values.isin(_true_values | _false_values)
+            if bad.any():
+                raise ValueError(
+                    "not boolean values like %r given" %
+                    column[~null][bad].tolist()[0]
+                )
+            return values.isin(_true_values).reindex(column.index).astype(
+                object
+            ).where(~null, None)
+        if kind in ("datetime", "date"):
+            if dtype.kind != "M":
+                converted = pandas.to_datetime(
+                    column, errors="coerce", format="mixed"
+                )
+                bad = converted.isna() & ~null
+                if bad.any():
+                    raise ValueError(
+                        "not datetime values like %r given" %
+                        column[bad].tolist()[0]
+                    )
+                column = converted
+            tz = getattr(column.dtype, "tz", None)
+            with_tz = (
+                self.sgbd_name != "sqlitedb" and
+                ("with time zone" in spec["type"].lower() or
+                 "tz" in spec["type"].lower()) and
+                "without" not in spec["type"].lower()
+            )
+            if tz is not None and not with_tz:
+                # stored as the UTC time
+                column = column.dt.tz_convert("UTC").dt.tz_localize(None)
+            if self.sgbd_name == "sqlitedb":
+                # the sqlite3 default adapters are deprecated: same text
+                # as them (isoformat), the microseconds only when not 0
+                if kind == "date":
+                    return column.dt.strftime("%Y-%m-%d").where(~null, None)
+                text = column.dt.strftime("%Y-%m-%d %H:%M:%S")
+                micro = (column.dt.microsecond != 0) & ~null
+                if micro.any():
+                    text = text.where(
+                        ~micro, column.dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+                    )
+                return text.where(~null, None)
+            if kind == "date":
+                return column.dt.date.where(~null, None)
+            return column
+        if kind == "text":
+            if is_numpy and dtype.kind == "M":
+                return column.dt.strftime("%Y-%m-%d %H:%M:%S").where(
+                    ~null, None
+                )
+            if (is_numpy and dtype.kind != "O") or (
+                    not is_numpy and not pandas.api.types.is_string_dtype(
+                        dtype
+                    )
+            ):
+                return column.astype(str).where(~null, None)
+            # the nested objects (JSON Lines records) are stored as json
+            return _dump_json(column, text=True)
+        if kind == "json":
+            return _dump_json(column)
+        return column
+
+
+def _dump_json(column, text=False):
+    # the nested objects as json, the numpy scalars (lists of dicts, mixed
+    # columns) as python values: sqlite3 stores a numpy.int64 as a blob
+    def _value(value):
+        if isinstance(value, numpy.generic):
+            value = value.item()
+            return str(value) if text else value
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        return value
+
+    if isinstance(column.dtype, numpy.dtype) and column.dtype.kind == "O":
+        return column.map(_value)
+    return column
+
+
+def _bool_text(value):
+    # 1.0 and 0.0 are accepted like 1 and 0
+    if isinstance(value, (int, float, decimal.Decimal)) and value in (0, 1):
+        return "1" if value else "0"
+    return value
+
+
+def _to_integer(column, null):
+    def _convert(value):
+        if isinstance(value, (int, numpy.integer)):
+            return int(value)
+        number = value
+        if isinstance(value, str):
+            try:
+                return int(value.strip())
+            except ValueError:
+                number = value.strip()
+        try:
+            number = decimal.Decimal(number)
+        except (TypeError, ValueError, decimal.InvalidOperation):
+            raise ValueError(
+                "not numeric values like %r given" % value
+            ) from None
+        if not number.is_finite() or number % 1:
+            raise ValueError("decimal values like %r given" % value)
+        return int(number)
+
+    values = [
+        None if is_null else _convert(value)
+        for value, is_null in zip(column.tolist(), null.tolist())
+    ]
+    try:
+        values = pandas.array(values, dtype="Int64")
+    except (OverflowError, TypeError, ValueError):
+        # out of the int64 range: the python ints are kept
+        values = numpy.array(values, dtype=object)
+    return pandas.Series(values, index=column.index, name=column.name)
+
+
+def _check_numeric(column, null):
+    converted = pandas.to_numeric(column, errors="coerce")
+    bad = converted.isna() & ~null
+    if bad.any():
+        raise ValueError(
+            "not numeric values like %r given" % column[bad].tolist()[0]
+        )
+    return converted
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+"""
+Single pass parser for the sql schema files used by the auto migration
+"""
+from __future__ import annotations
+
+import bisect
+import re
+
+_fields_types_reg = {
+    "postgresdb": (
+        "bigint", "bigserial", r"bit(?:\s*\(\s*\d+\s*\))?\b", r"bit\s+varying",
+        r"bool(?:ean)?\b", "box", "bytea",
+        r"char(?:acter)?(?:\s*\(\s*\d+\s*\))?",
+        r"character\s+varying(?:\s*\(\s*\d+\s*\))?", "cidr", "circle",
+        r"date\b", r"double\s+precision", "inet", "integer", r"json\b",
+        "jsonb", "line", "smallint", "real", "smallserial", r"serial\d?\b",
+        "text", "uuid", r"varbit(?:\s*\(\s*\d+\s*\))?",
+        r"time(?:tz)?\b(?:\s*\(\s*\d+\s*\))?(?:\s*without\s+time\s+zone)?",
+        r"timestamp(?:tz)?(?:\s*\(\s*\d+\s*\))?(?:\s*without\s+time\s+zone)?",
+        r"numeric(?:\s*\(\s*\d+\s*(?:,\s*\d+\s*)?\))?",  # a voir
+        r"decimal(?:\s*\(\s*\d+\s*(?:,\s*\d+\s*)?\))?",  # a voir
+        r"int\d?\b", r"float\d?\b", r"varchar(?:\s*\(\s*\d+\s*\))?",
+
+    )
+}
+
+_container_extra = {
+    "postgresdb": [("'", "'"), ("(", ")")]
+}
+
+_comments = {
+    "postgresdb": {
+        "single_line": "--",
+        "multi_line": ("/*", "*/")
+    },
+    "sqlitedb": {
+        "single_line": "--",
+        "multi_line": ("/*", "*/")
+    }
+}
+
+# words starting a table constraint instead of a column definition
+_constraint_words = {
+    "constraint", "primary", "foreign", "unique", "check", "exclude",
+    "key", "index",
+}
+
+_create_table_reg = re.compile(
+    r"\s*create\s+table(?:\s+if\s+not\s+exists)?\s+(\w+)\s*\(",
+    flags=re.I | re.S
+)
+_create_index_reg = re.compile(
+    r"\s*create\s+(unique\s+)?index\s+(?:concurrently\s+)?"
+    r"(?:if\s+not\s+exists\s+)?(?:(?!on\s)(\w+)\s+)?on\s+(?:only\s+)?"
+    r"(?:\w+\.)?(\w+)\s*(?:using\s+(\w+)\s*)?\(",
+    flags=re.I | re.S
+)
+_where_reg = re.compile(r"\bwhere\b", flags=re.I)
+_prev_name_reg = re.compile(
+    r"prev(?:ious)?[\s|_]+(?:name|columns|field|table)\s*:\s*(\w+)",
+    flags=re.I
+)
+_serial_pk_reg = re.compile(
+    r"\binteger\s+primary\s+key\s+auto_?increment\b", flags=re.I
+)
+_auto_increment_reg = re.compile(r"\bauto_?increment\b", flags=re.I)
+
+_column_regs = {}
+
+
+def _column_reg(sgbd_name):
+    reg = _column_regs.get(sgbd_name)
+    if reg is None:
+        if sgbd_name in _fields_types_reg:
+            _types = "|".join(
+                r"%s" % (t,) for t in _fields_types_reg[sgbd_name])
+        else:
+            _types = r"\w+(?:\s*\(\s*\d+\s*\))?"
+        reg = re.compile(
+            rf"^(\w+)\s+({_types})(?:\w*?)?(\s+not\s+null)?"
+            r"(\s+primary\s+key)?(.*)$",
+            flags=re.S | re.I
+        )
+        _column_regs[sgbd_name] = reg
+    return reg
+
+
+def previous_name_from_comment(comment):
+    """
+    Get the previous name given in a comment like `previous_name: name`
+    """
+    if comment:
+        previous_name = _prev_name_reg.search(comment)
+        if previous_name:
+            return previous_name.groups()[0]
+
+
+def tokenize(script, comment=None):
+    """
+    Walk the script once and split it in statements.
+    Args:
+        script: str, the sql script
+        comment: dict, the comment markers (single_line, multi_line)
+
+    Returns:
+        tuple (text, statements, comments) where text is the script without
+        comments, statements a list of (start, end) positions in text and
+        comments a sorted list of (position in text, single line comment)
+    """
+    single_line = multi_line = None
+    markers = ["'", '"', ";"]
+    if comment:
+        single_line = comment["single_line"]
+        multi_line = comment["multi_line"]
+        markers += [single_line, multi_line[0]]
+    special = re.compile("|".join(re.escape(m) for m in markers))
+    out = []
+    out_size = 0
+    comments = []
+    statements = []
+    start = 0
+    i = 0
+    size = len(script)
+    while i < size:
+        m = special.search(script, i)
+        if m is None:
+            out.append(script[i:])
+            out_size += size - i
+            break
+        out.append(script[i:m.start()])
+        out_size += m.start() - i
+        token = m.group()
+        i = m.end()
+        if token in ("'", '"'):
+            end = script.find(token, i)
+            end = size if end < 0 else end + 1
+            out.append(script[m.start():end])
+            out_size += end - m.start()
+            i = end
+        elif token == ";":
+            statements.append((start, out_size))
+            out.append(token)
+            out_size += 1
+            start = out_size
+        elif token == single_line:
+            end = script.find("\n", i)
+            if end < 0:
+                end = size
+            comments.append((out_size, script[i:end]))
+            i = end
+        else:
+            end = script.find(multi_line[1], i)
+            i = size if end < 0 else end + len(multi_line[1])
+    text = "".join(out)
+    if text[start:].strip():
+        statements.append((start, len(text)))
+    return text, statements, comments
+
+
+def _split_definitions(content):
+    """Split a table body on its top level commas"""
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    for i, c in enumerate(content):
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in ("'", '"'):
+            quote = c
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "," and depth == 0:
+            parts.append((start, content[start:i]))
+            start = i + 1
+    parts.append((start, content[start:]))
+    return parts
+
+
+def _closing_parenthesis(text, start, end=None):
+    """Position of the parenthesis closing the one opened before start"""
+    depth = 1
+    quote = None
+    for i in range(start, len(text) if end is None else end):
+        c = text[i]
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in ("'", '"'):
+            quote = c
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+
+def parse_index(statement, start=0, end=None):
+    """
+    Parse a CREATE INDEX statement
+    Args:
+        statement: str
+        start: int, where the statement starts in the given text
+        end: int, where the statement ends in the given text
+
+    Returns:
+        dict like {
+            "name": "users_email_idx",
+            "table": "users",
+            "unique": True,
+            "method": "btree",
+            "columns": "lower(email)",
+            "where": "deleted_at IS NULL",
+            "extra": ""
+        } or None if the statement isn't a CREATE INDEX statement
+    """
+    if end is None:
+        end = len(statement)
+    m = _create_index_reg.match(statement, start, end)
+    if not m:
+        return None
+    close = _closing_parenthesis(statement, m.end(), end)
+    if close < 0:
+        return None
+    unique, name, table, method = m.groups()
+    columns = " ".join(statement[m.end():close].split())
+    rest = statement[close + 1:end]
+    where = None
+    w = _where_reg.search(rest)
+    if w:
+        where = " ".join(rest[w.end():].split())
+        rest = rest[:w.start()]
+    if not name:
+        # same kind of name postgres would have generated
+        name = "_".join([table] + re.findall(r"[a-zA-Z]\w*", columns)[:3])
+        name += "_idx"
+    return {
+        "name": name,
+        "table": table,
+        "unique": unique is not None,
+        "method": method,
+        "columns": columns,
+        "where": where,
+        "extra": " ".join(rest.split()),
+    }
+
+
+def extract_default(extra, container):
+    """Get the value given after the DEFAULT keyword of a column"""
+    _cur = ""
+    default = ""
+    _s_cont = ""
+
+    for _car in extra:
+        _is_new_line = _car.isspace()
+        if _cur.lower() == "default":
+            if _is_new_line and default == "":
+                continue
+            if not _s_cont and _is_new_line:
+                break
+            for cont in container:
+                if _car == cont[0]:
+                    if cont[0] == cont[
+                            1] and _s_cont and _car == _s_cont[-1]:
+                        _s_cont = _s_cont[:-1]
+                        break
+                    _s_cont += cont[1]
+                    break
+                elif _s_cont and _car == _s_cont[-1]:
+                    _s_cont = _s_cont[:-1]
+                    break
+            default += _car
+            continue
+        if _is_new_line:
+            _cur = ""
+            continue
+        _cur += _car
+    return default.strip()
+
+
+def parse_schema(script, sgbd_name="postgresdb"):
+    """
+    Parse a sql schema script (CREATE TABLE statements).
+    Args:
+        script: str, the sql script
+        sgbd_name: str, the driver module name (postgresdb, sqlitedb, ...)
+
+    Returns:
+        dict like {
+            table_name: {
+                "content": "the table body",
+                "previous_name": None,
+                "indexes": [see parse_index],
+                "columns": [
+                    {
+                        "col_name": "id",
+                        "previous_name": None,
+                        "type": "integer",
+                        "not_null": False,
+                        "is_primary_key": True,
+                        "column_default": "",
+                        "extra": "primary key"
+                    }
+                ]
+            }
+        }
+    """
+    _comment = _comments.get(sgbd_name)
+    text, statements, comments = tokenize(script, _comment)
+    comments_pos = [p for p, _ in comments]
+    new_lines = [m.start() for m in re.finditer("\n", text)]
+    comment_by_line = {}
+    for pos, comment in comments:
+        comment_by_line.setdefault(
+            bisect.bisect_left(new_lines, pos), comment
+        )
+
+    column_reg = _column_reg(sgbd_name)
+    _container = (_container_extra.get(sgbd_name) or
+                  [("'", "'"), ("(", ")"), ("\"", "\"")])
+    schema = {}
+    indexes = []
+    for start, end in statements:
+        m = _create_table_reg.match(text, start, end)
+        if not m:
+            index = parse_index(text, start, end)
+            if index is not None:
+                indexes.append(index)
+            continue
+        close = text.rfind(")", m.end(), end)
+        if close < 0 or text[close + 1:end].strip():
+            continue
+        table_name, = m.groups()
+        content = text[m.end():close]
+
+        table_last_name = None
+        if _comment:
+            name_end = m.end(1)
+            index = bisect.bisect_left(comments_pos, name_end)
+            if (
+                    index < len(comments) and
+                    text[name_end:comments_pos[index]].strip() in ("", "(")
+            ):
+                table_last_name = previous_name_from_comment(
+                    comments[index][1]
+                )
+
+        _is_postgres = "postgres" in sgbd_name
+        if _is_postgres:
+            content = _serial_pk_reg.sub("SERIAL primary key", content)
+            content = _auto_increment_reg.sub("SERIAL", content)
+
+        final_columns = []
+        for offset, definition in _split_definitions(text[m.end():close]):
+            lstrip = definition.lstrip()
+            if not lstrip:
+                continue
+            first_word = lstrip.split(None, 1)[0].split("(", 1)[0].lower()
+            if first_word in _constraint_words:
+                continue
+            if _is_postgres:
+                lstrip = _serial_pk_reg.sub("SERIAL primary key", lstrip)
+                lstrip = _auto_increment_reg.sub("SERIAL", lstrip)
+            c = column_reg.match(lstrip)
+            if not c:
+                continue
+            c = c.groups()
+            extra = c[4].strip()
+            is_primary_key = c[3]
+
+            previous_name = None
+            if _comment:
+                line = bisect.bisect_left(
+                    new_lines,
+                    m.end() + offset + len(definition) - len(
+                        definition.lstrip()
+                    )
+                )
+                previous_name = previous_name_from_comment(
+                    comment_by_line.get(line)
+                )
+
+            final_columns.append(
+                {
+                    "col_name": c[0],
+                    "previous_name": previous_name,
+                    "type": c[1],
+                    "not_null": (c[2] not in ("", None)),
+                    "is_primary_key": is_primary_key not in ("", None),
+                    "column_default": extract_default(extra, _container),
+                    "extra": (
+                            (c[2] or "") + " " +
+                            (is_primary_key or "") + " " +
+                            extra
+                    ).strip()
+                }
+            )
+
+        schema[table_name] = {
+            "content": content,
+            "columns": final_columns,
+            "previous_name": table_last_name,
+            "indexes": []
+        }
+    for index in indexes:
+        if index["table"] in schema:
+            schema[index["table"]]["indexes"].append(index)
+    return schema
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+In-process fake driver: a synthetic DB-API connection answering instantly,
+used to measure the overhead of the library code without any database.
+    >>> db = DataManager("fake://?rows=100000&columns=8&dialect=postgres")
+    >>> db.run_script("SELECT * FROM anything", dict_res=True)
+"""
+from __future__ import annotations
+
+import datetime
+import decimal
+import itertools
+import re
+
+from kb_tools.database.basedb import BaseDB
+from kb_tools.tools import Cdict
+
+_read_reg = re.compile(r"^\s*(select|with|values|show|pragma)\b", flags=re.I)
+_returning_reg = re.compile(r"\breturning\b", flags=re.I)
+_limit_reg = re.compile(r"\blimit\s+(\d+)\s*;?\s*$", flags=re.I)
+
+_values = {
+    "int": lambda i: i,
+    "float": lambda i: i * 0.5,
+    "str": lambda i: "value %d" % i,
+    "decimal": lambda i: decimal.Decimal(i) / 100,
+    "date": lambda i: datetime.date(2020, 1, 1) + datetime.timedelta(i),
+    "datetime": lambda i: (
+            datetime.datetime(2020, 1, 1) + datetime.timedelta(seconds=i)
+    ),
+    "bool": lambda i: i % 2 == 0,
+    "null": lambda i: None,
+}
+_schema_types = {
+    "int": "integer",
+    "float": "real",
+    "str": "text",
+    "decimal": "numeric",
+    "date": "date",
+    "datetime": "timestamp",
+    "bool": "boolean",
+    "null": "text",
+}
+
+_dialects = ("sqlite", "postgres")
+
+
+class FakeCursor:
+    """DB-API cursor returning the rows of its connection"""
+
+    arraysize = 1
+
+    def __init__(self, connection: FakeConnection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+        self._rows = iter(())
+
+    def execute(self, script, params=None):
+        self.connection.statements += 1
+        if _read_reg.match(script) or _returning_reg.search(script):
+            size = self.connection.rows
+            limit = _limit_reg.search(script)
+            if limit:
+                size = min(size, int(limit.groups()[0]))
+            self.description = self.connection.description
+            self.rowcount = size
+            self._rows = itertools.islice(
+                itertools.cycle(self.connection.block), size
+            )
+        else:
+            self.description = None
+            self.rowcount = 1
+            self._rows = iter(())
+        return self
+
+    def executemany(self, script, seq_of_params):
+        self.connection.statements += 1
+        self.description = None
+        self.rowcount = sum(1 for _ in seq_of_params)
+        self._rows = iter(())
+        return self
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchmany(self, size=None):
+        return list(itertools.islice(self._rows, size or self.arraysize))
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def __iter__(self):
+        return self._rows
+
+    def close(self):
+        self._rows = iter(())
+
+
+class FakeConnection:
+    """
+    DB-API connection without I/O
+    Args:
+        rows: int, the number of rows returned by each read request
+        columns: int or list of column names
+        types: list of value types used in turn by the columns (int,
+            float, str, decimal, date, datetime, bool, null)
+        dialect: str, sqlite or postgres: the driver whose parameter
+            handling is used
+    """
+    # distinct rows generated, the others are repeated
+    BLOCK_SIZE = 1000
+
+    def __init__(self, rows=1000, columns=5, types=None, dialect="sqlite"):
+        if isinstance(columns, str):
+            columns = int(columns) if columns.isdigit() else columns.split(",")
+        if isinstance(columns, int):
+            columns = ["c%d" % i for i in range(columns)]
+        if isinstance(types, str):
+            types = types.split(",")
+        types = list(types or ("int", "str", "float", "decimal", "datetime"))
+        for t in types:
+            assert t in _values, "Bad fake value type %s given" % t
+        assert dialect in _dialects, "Bad fake dialect %s given" % dialect
+        self.rows = int(rows)
+        self.columns = list(columns)
+        self.types = [types[i % len(types)] for i in range(len(columns))]
+        self.dialect = dialect
+        self.description = [
+            (name, None, None, None, None, None, None) for name in self.columns
+        ]
+        self.block = [
+            tuple(_values[t](i) for t in self.types)
+            for i in range(max(min(self.rows, self.BLOCK_SIZE), 1))
+        ]
+        self.statements = 0
+        self.closed = False
+
+    def cursor(self):
+        if self.closed:
+            raise RuntimeError("Connection closed")
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def cancel(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDB(BaseDB):
+    """
+    BaseDB backed by a FakeConnection. The connection args are given as
+    kwargs or in the uri query: fake://?rows=1000&columns=5&types=int,str
+    &dialect=postgres&table=fake
+    """
+    URI_QUERY_ARGS = ("rows", "columns", "types", "dialect", "table")
+
+    def __init__(self, **kwargs):
+        dialect = str(kwargs.get("dialect") or "sqlite").lower()
+        kwargs["dialect"] = "postgres" if "postgres" in dialect else dialect
+        super().__init__(**kwargs)
+
+    @property
+    def dialect(self):
+        return self._kwargs["dialect"]
+
+    @property
+    def get_schema(self):
+        connection = self.db_object or self.connect(**self._kwargs)
+        return [
+            Cdict({
+                "columnName": name,
+                "type": _schema_types[t],
+                "tableName": self._kwargs.get("table") or "fake",
+                "columnDefault": None,
+                "nullable": 1,
+                "is_primary_key": 0,
+                "foreign_table_name": None,
+                "foreign_column_name": None,
+            })
+            for name, t in zip(connection.columns, connection.types)
+        ]
+
+    def cancel(self):
+        if self.db_object is not None:
+            self.db_object.cancel()
+
+    @staticmethod
+    def connect(
+            rows=1000, columns=5, types=None, dialect="sqlite", **kwargs
+    ) -> FakeConnection:
+        return FakeConnection(
+            rows=rows, columns=columns, types=types, dialect=dialect
+        )
+
+    def _cursor(self):
+        return self.db_object.cursor()
+
+    @staticmethod
+    def _execute(cursor: FakeCursor, script, params=None, ignore_error=False,
+                 **kwargs):
+        # the params are reshaped like the driver of the dialect does
+        if cursor.connection.dialect == "sqlite":
+            from kb_tools.database.sqlitedb import SQLiteDB
+
+            return SQLiteDB._execute(
+                cursor, script, params=params, ignore_error=ignore_error,
+                **kwargs
+            )
+        try:
+            from kb_tools.database.postgresdb import PostgresDB
+        except ImportError:
+            # psycopg2 missing: same reshaping without the LIKE handling
+            params = BaseDB._parse_params_no_dict(params, script)
+            method = "execute" + (
+                "many" if kwargs.get("method") == "many" else ""
+            )
+            if not isinstance(params, (tuple, list, dict)):
+                params = (params,)
+            try:
+                getattr(cursor, method)(script, params)
+                return cursor
+            except Exception:
+                if ignore_error:
+                    return None
+                raise
+        return PostgresDB._execute(
+            cursor, script, params=params, ignore_error=ignore_error,
+            **kwargs
+        )
+
+    @staticmethod
+    def _get_cursor_description(cursor):
+        return Cdict(columns=[desc[0] for desc in cursor.description or []])
+
+    def prepare_insert_data(self, data: dict):
+        placeholder = "%s" if self.dialect == "postgres" else "?"
+        return [placeholder for _ in data], list(data.values())
+
+    def dict_params(self, k):
+        if self.dialect == "postgres":
+            return f"%({k})s"
+        return ":" + str(k)
+
+    @property
+    def name(self):
+        # the library branches on the name (Decimal conversion, ...)
+        return self.dialect.upper()
+
+
+if __name__ == "__main__":
+    pass
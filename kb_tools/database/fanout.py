@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Run the same script against several databases at the same time
+"""
+from __future__ import annotations
+
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from kb_tools.database.basedb import BaseDB
+
+
+class FanOutResult:
+    """
+    Result of the script on one target. `error` is set instead of `data`
+    when the target failed (TimeoutError when it took more than the
+    timeout given).
+    """
+
+    def __init__(self, source, data=None, columns=None, error=None,
+                 elapsed=None):
+        self.source = source
+        self.data = data
+        self.columns = columns
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return "<FanOutResult %s: %d rows>" % (
+                self.source, len(self.data or [])
+            )
+        return "<FanOutResult %s: %r>" % (self.source, self.error)
+
+
+class FanOutResults(list):
+    """The results of all the targets, in the order of the targets"""
+
+    @property
+    def errors(self):
+        return {r.source: r.error for r in self if not r.ok}
+
+    def rows(self, source_column="source"):
+        """
+        Merge the rows of all the succeeded targets, each row getting the
+        source of its target (first element or `source_column` key).
+        """
+        rows = []
+        for result in self:
+            if not result.ok:
+                continue
+            for row in result.data or []:
+                if hasattr(row, "keys"):
+                    rows.append({source_column: result.source, **row})
+                else:
+                    rows.append((result.source, *row))
+        return rows
+
+    def to_dataframe(self, source_column="source"):
+        import pandas
+
+        frames = []
+        for result in self:
+            if not result.ok or not result.data:
+                continue
+            if hasattr(result.data[0], "keys"):
+                frame = pandas.DataFrame([dict(r) for r in result.data])
+            else:
+                frame = pandas.DataFrame(
+                    [tuple(r) for r in result.data], columns=result.columns
+                )
+            frame.insert(0, source_column, result.source)
+            frames.append(frame)
+        if not frames:
+            return pandas.DataFrame(columns=[source_column])
+        return pandas.concat(frames, ignore_index=True)
+
+
+def _label(target):
+    if isinstance(target, str):
+        from kb_tools.database import DataManager
+
+        uri = DataManager.parse_uri(target)
+        if uri["drivername"] == "sqlite":
+            return uri["file_name"]
+        return "%s://%s%s/%s" % (
+            uri["drivername"], uri["host"] or "",
+            ":%s" % uri["port"] if uri["port"] else "", uri["database"] or ""
+        )
+    kwargs = getattr(target, "_kwargs", {})
+    if kwargs.get("db_name") or kwargs.get("host"):
+        return "%s://%s%s/%s" % (
+            target.name.lower(), kwargs.get("host") or "",
+            ":%s" % kwargs["port"] if kwargs.get("port") else "",
+            kwargs.get("db_name") or ""
+        )
+    return str(kwargs.get("file_name") or target.name)
+
+
+def _targets(targets):
+    if isinstance(targets, dict):
+        return list(targets.items())
+    result = []
+    seen = {}
+    for target in targets:
+        source = _label(target)
+        seen[source] = seen.get(source, 0) + 1
+        if seen[source] > 1:
+            source += "#%d" % seen[source]
+        result.append((source, target))
+    return result
+
+
+def _worker_db(target):
+    """The BaseDB object used by the worker thread for a BaseDB target"""
+    if not target.__class__.__module__.endswith("sqlitedb"):
+        return target
+    # a sqlite connection can't be used from another thread: open a new
+    # one, which is not possible for a memory database
+    if str(target._kwargs.get("file_name") or ":memory:") == ":memory:":
+        raise ValueError(
+            "A sqlite memory database can't be requested from another thread"
+        )
+    return target.__class__(**target._kwargs)
+
+
+def _run_one(source, target, script, params, timeout, run_kwargs,
+             db_kwargs):
+    start = time.perf_counter()
+    db_object = target
+    timer = None
+    timed_out = threading.Event()
+    try:
+        if not isinstance(target, BaseDB):
+            from kb_tools.database import DataManager
+
+            db_kwargs = dict(db_kwargs)
+            if timeout:
+                db_kwargs.setdefault(
+                    "connect_timeout", max(1, math.ceil(timeout))
+                )
+            db_object = DataManager(target, **db_kwargs)
+        else:
+            db_object = _worker_db(target)
+        # connect before arming the timeout: cancel() needs the connection
+        if db_object.db_object is None or not db_object._is_connected():
+            db_object.reload_connexion()
+        if timeout:
+            remaining = timeout - (time.perf_counter() - start)
+            if remaining <= 0:
+                raise TimeoutError("Timeout after %ss" % timeout)
+
+            def _on_timeout():
+                timed_out.set()
+                db_object.cancel()
+
+            timer = threading.Timer(remaining, _on_timeout)
+            timer.daemon = True
+            timer.start()
+        data = db_object.run_script(script, params=params, **run_kwargs)
+        columns = db_object.LAST_REQUEST_COLUMNS
+        if timed_out.is_set():
+            raise TimeoutError("Timeout after %ss" % timeout)
+        return FanOutResult(
+            source, data=data, columns=columns,
+            elapsed=time.perf_counter() - start
+        )
+    except Exception as ex:  # noqa
+        if timed_out.is_set():
+            ex = TimeoutError("Timeout after %ss" % timeout)
+        return FanOutResult(
+            source, error=ex, elapsed=time.perf_counter() - start
+        )
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if db_object is not target and db_object is not None:
+            db_object.close_connection()
+
+
+def iter_fan_out(
+        targets, script, params=None, *, max_workers=8, timeout=None,
+        db_kwargs=None, **kwargs
+):
+    """
+    Run the script on each target and yield the results as they arrive
+    Args:
+        targets: list of uri or BaseDB objects, or dict {source: target}
+        script: str, the script to run
+        params: the script params
+        max_workers: int, how many targets are requested at the same time
+        timeout: float, max duration in seconds for each target,
+            connection included. The running query is cancelled when the
+            driver allows it, the connection of the uri targets gets a
+            connect_timeout
+        db_kwargs: dict, kwargs given to DataManager for the uri targets.
+            A sqlite BaseDB target gets a new connection in the worker
+            thread (so a sqlite memory database can't be a target)
+        **kwargs: run_script kwargs (dict_res, limit, ...)
+
+    Returns:
+        generator of FanOutResult
+    """
+    targets = _targets(targets)
+    if not targets:
+        return
+    with ThreadPoolExecutor(
+            max_workers=max(1, min(int(max_workers), len(targets)))
+    ) as executor:
+        futures = [
+            executor.submit(
+                _run_one, source, target, script, params, timeout,
+                kwargs, db_kwargs or {}
+            )
+            for source, target in targets
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def fan_out(
+        targets, script, params=None, *, max_workers=8, timeout=None,
+        as_dataframe=False, source_column="source", db_kwargs=None,
+        **kwargs
+):
+    """
+    Run the script on each target concurrently. A failing target doesn't
+    stop the others: see FanOutResults.errors.
+    Examples:
+        >>> res = fan_out(uris, "SELECT count(*) FROM sales", timeout=30)
+        >>> res.rows()  # [(source, count), ...]
+        >>> fan_out(uris, script, as_dataframe=True, dict_res=True)
+    Args:
+        as_dataframe: bool, return a pandas.DataFrame with a source column
+            holding the rows of all the succeeded targets
+        source_column: str, the name of the source column
+        see iter_fan_out for the other args
+
+    Returns:
+        FanOutResults or pandas.DataFrame
+    """
+    targets = _targets(targets)
+    order = {source: i for i, (source, _) in enumerate(targets)}
+    results = FanOutResults(
+        sorted(
+            iter_fan_out(
+                dict(targets), script, params=params,
+                max_workers=max_workers, timeout=timeout,
+                db_kwargs=db_kwargs, **kwargs
+            ),
+            key=lambda r: order[r.source]
+        )
+    )
+    if as_dataframe:
+        return results.to_dataframe(source_column=source_column)
+    return results
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+"""
+Migration plan: the list of statements needed to go from the current
+database schema to the schema described in a sql schema file
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+
+from kb_tools.database.ddl import parse_index
+from kb_tools.tools import Cdict
+
+_modify_column_type = {
+    "postgresdb": "ALTER COLUMN {column} TYPE {type}",
+    "mysqldb": "MODIFY ({column} {type})"
+}
+
+# drivers accepting several actions in the same ALTER TABLE statement
+_multiple_alter_actions = ("postgresdb", "mysqldb")
+
+# drivers able to build an index without locking the table writes
+_concurrent_index = ("postgresdb",)
+
+_cast_reg = re.compile(r"::\w+(?:\s+(?:varying|precision))?(?:\[\])?")
+
+
+def _is_some_type_equal_another(type1, type2):
+    type1 = re.sub(
+        r"\s\s+", " ",
+        re.sub(r"(\W)\s+", r"\1", re.sub(r"\s+(\W)", r"\1", type1))
+    ).lower()
+    type2 = re.sub(
+        r"\s\s+", " ",
+        re.sub(r"(\W)\s+", r"\1", re.sub(r"\s+(\W)", r"\1", type2))
+    ).lower()
+    _t = {"1": type1, "2": type2}
+    for k, v in list(_t.items()):
+        if v.startswith("character varying"):
+            _t[k] = "varchar" + v.split("character varying")[1]
+        elif v.startswith("character"):
+            _t[k] = "char" + v.split("character")[1]
+        elif v.startswith("int"):
+            _t[k] = "integer"
+        elif v in ("float", "real", "double precision"):
+            _t[k] = "real"
+        elif v.startswith(("bool",)):
+            _t[k] = "boolean"
+        elif v.startswith(("bit varying",)):
+            _t[k] = "varbit" + v.split("bit varying")[1]
+        if v.startswith("timestamp"):
+            _t[k] = "timestamp"
+
+    return _t["1"] == _t["2"]
+
+
+def _normalize_expression(expression):
+    expression = _cast_reg.sub("", str(expression or "").lower())
+    return re.sub(r"[\s()\"]", "", expression)
+
+
+def _index_signature(index):
+    method = (index["method"] or "").lower()
+    return (
+        bool(index["unique"]),
+        "" if method == "btree" else method,
+        _normalize_expression(index["columns"]),
+        _normalize_expression(index["where"]),
+        _normalize_expression(index["extra"]),
+    )
+
+
+def _index_statement(index, concurrently=False):
+    script = (
+        "CREATE " + ("UNIQUE " if index["unique"] else "") + "INDEX " +
+        ("CONCURRENTLY " if concurrently else "") +
+        f"{index['name']} ON {index['table']}"
+    )
+    if index["method"]:
+        script += f" USING {index['method']}"
+    script += f" ({index['columns']})"
+    if index["extra"]:
+        script += " " + index["extra"]
+    if index["where"]:
+        script += f" WHERE {index['where']}"
+    return script
+
+
+def compute_schema_hash(schema, sgbd_name):
+    """The hash recorded in the MIGRATION_TABLE for a schema script"""
+    return hashlib.sha256(
+        (sgbd_name + "\n" + schema).encode("utf-8")
+    ).hexdigest()
+
+
+def _create_migration_table(db_object):
+    db_object.run_script(
+        f"CREATE TABLE IF NOT EXISTS {db_object.MIGRATION_TABLE} ("
+        "schema_hash VARCHAR(64) NOT NULL, "
+        "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+        retrieve=False, primary=True
+    )
+
+
+def get_applied_schema_hash(db_object):
+    """The hash of the last schema applied, None if there is no one"""
+    _create_migration_table(db_object)
+    row = db_object.run_script(
+        f"SELECT schema_hash FROM {db_object.MIGRATION_TABLE}", limit=1,
+        primary=True
+    )
+    if row:
+        return row[0]
+
+
+def set_applied_schema_hash(db_object, schema_hash):
+    _create_migration_table(db_object)
+    db_object.run_script(
+        f"DELETE FROM {db_object.MIGRATION_TABLE}", retrieve=False
+    )
+    db_object.run_script(
+        f"INSERT INTO {db_object.MIGRATION_TABLE} (schema_hash) "
+        "VALUES (%s)",
+        params=(schema_hash,),
+        retrieve=False
+    )
+
+
+class MigrationOperation:
+    """
+    One change of the plan. `clause` is the ALTER TABLE action when the
+    operation can be merged with the other actions on the same table.
+    """
+
+    def __init__(
+            self, table, action, statement, clause=None, transactional=True
+    ):
+        self.table = table
+        self.action = action
+        self.statement = statement
+        self.clause = clause
+        self.transactional = transactional
+
+    def to_dict(self):
+        return {
+            "table": self.table,
+            "action": self.action,
+            "statement": self.statement,
+            "transactional": self.transactional,
+        }
+
+    def __repr__(self):
+        return "<MigrationOperation %s %r>" % (self.action, self.statement)
+
+
+class MigrationPlan:
+    def __init__(self, sgbd_name, schema_hash=None):
+        self.sgbd_name = sgbd_name
+        # recorded by apply, see compute_schema_hash
+        self.schema_hash = schema_hash
+        self.operations = []
+        self.warnings = []
+
+    def add(
+            self, table, action, statement=None, clause=None,
+            transactional=True
+    ):
+        if statement is None:
+            statement = f"ALTER TABLE {table} {clause}"
+        self.operations.append(
+            MigrationOperation(
+                table, action, statement, clause=clause,
+                transactional=transactional
+            )
+        )
+
+    def statements(self, batch=True, transactional=None):
+        """
+        The statements to run.
+        Args:
+            batch: bool, merge the actions on the same table in one
+                ALTER TABLE statement when the driver supports it. Renames
+                can't be merged: they are run first.
+            transactional: bool, only get the statements to run inside
+                (True) or outside (False) the migration transaction,
+                default all of them, the transactional ones first
+
+        Returns:
+            list of str
+        """
+        if transactional is None:
+            return (
+                self.statements(batch=batch, transactional=True) +
+                self.statements(batch=batch, transactional=False)
+            )
+        operations = [
+            op for op in self.operations
+            if op.transactional == transactional
+        ]
+        if not batch or self.sgbd_name not in _multiple_alter_actions:
+            return [op.statement for op in operations]
+        tables = {}
+        for op in operations:
+            before, clauses = tables.setdefault(op.table, ([], []))
+            if op.clause is None or op.action.startswith("rename"):
+                before.append(op.statement)
+            else:
+                clauses.append(op.clause)
+        result = []
+        for table, (before, clauses) in tables.items():
+            result.extend(before)
+            if clauses:
+                result.append(
+                    f"ALTER TABLE {table} " + ",\n    ".join(clauses)
+                )
+        return result
+
+    def apply(self, db_object, batch=True):
+        """
+        Run all the statements of the plan in one transaction, under the
+        migration lock of the database. The schema hash of the plan is
+        recorded like init_db does, so the next init_db doesn't migrate
+        again.
+        """
+        auto_commit = db_object.auto_commit
+        db_object.auto_commit = False
+        try:
+            with db_object.migration_lock():
+                try:
+                    for script in self.statements(
+                            batch=batch, transactional=True
+                    ):
+                        db_object.log_info(script)
+                        db_object.run_script(script, retrieve=False)
+                    outside = self.statements(transactional=False)
+                    if outside:
+                        db_object.commit()
+                        with db_object.no_transaction():
+                            for script in outside:
+                                db_object.log_info(script)
+                                db_object.run_script(script, retrieve=False)
+                    if self.schema_hash is not None:
+                        set_applied_schema_hash(db_object, self.schema_hash)
+                except Exception:
+                    db_object.rollback()
+                    raise
+                db_object.commit()
+        finally:
+            db_object.auto_commit = auto_commit
+
+    def to_dict(self, batch=True):
+        return {
+            "sgbd_name": self.sgbd_name,
+            "operations": [op.to_dict() for op in self.operations],
+            "statements": self.statements(batch=batch),
+            "warnings": list(self.warnings),
+        }
+
+    def to_json(self, file_path=None, indent=4, batch=True):
+        res = json.dumps(self.to_dict(batch=batch), indent=indent)
+        if file_path:
+            with open(file_path, "w") as file:
+                file.write(res)
+        return res
+
+    def __str__(self):
+        return "".join(s + ";\n" for s in self.statements())
+
+    def __len__(self):
+        return len(self.operations)
+
+    def __iter__(self):
+        return iter(self.operations)
+
+    def __repr__(self):
+        return "<MigrationPlan %s: %d operations>" % (
+            self.sgbd_name, len(self.operations)
+        )
+
+
+def plan_migration(
+        final_schema, current_schema, sgbd_name="postgresdb",
+        current_indexes=None, drop_unknown_indexes=False
+):
+    """
+    Compute the difference between the database and the wanted schema
+    Args:
+        final_schema: dict, result of ddl.parse_schema
+        current_schema: list, the BaseDB.get_schema result
+        sgbd_name: str, the driver module name
+        current_indexes: list, the BaseDB.get_indexes result. The indexes
+            are not compared when it's None
+        drop_unknown_indexes: bool, also drop the indexes of the declared
+            tables which are not in final_schema (like the ones created by
+            hand). By default only the declared indexes are compared
+
+    Returns:
+        MigrationPlan
+    """
+    plan = MigrationPlan(sgbd_name)
+    current_tables = set(c["tableName"] for c in current_schema)
+
+    def _update_field(_last, _new, _table):
+        if sgbd_name == "sqlitedb":
+            # alter table is limited for sqlitedb
+            if not _is_some_type_equal_another(
+                    _last["type"], _new["type"]
+            ):
+                plan.warnings.append(
+                    "Auto migration for sqlitedb cannot modify field type. "
+                    "needed: (%s.%s) from %s to %s" % (
+                        _table, _new['col_name'], _last['type'],
+                        _new['type']
+                    )
+                )
+            return
+        _s = (
+            _modify_column_type.get(sgbd_name) or
+            _modify_column_type.get("mysqldb")
+        )
+        if not _is_some_type_equal_another(_last["type"], _new["type"]):
+            if (
+                    _new['type'].lower().startswith("serial")
+                    and _last['type'].lower().startswith("int")
+            ):
+                return
+            _type = _new['type']
+            if _new.get("not_null") and not sgbd_name.startswith("postgres"):
+                _type += " NOT NULL"
+            plan.add(
+                _table, "alter_type",
+                clause=str(_s).format(type=_type, column=_new['col_name'])
+            )
+            if _new.get("not_null") and sgbd_name.startswith("postgres"):
+                plan.add(
+                    _table, "set_not_null",
+                    clause=f"ALTER COLUMN {_new['col_name']} SET NOT NULL"
+                )
+        if _new["column_default"]:
+            if (
+                    (_new["column_default"] or "").lower() !=
+                    (_last["column_default"] or "").lower()
+            ):
+                plan.add(
+                    _table, "set_default",
+                    clause=f"ALTER COLUMN {_new['col_name']} "
+                           f"SET DEFAULT {_new['column_default']}"
+                )
+        elif _last["column_default"]:
+            plan.add(
+                _table, "drop_default",
+                clause=f"ALTER COLUMN {_new['col_name']} DROP DEFAULT"
+            )
+
+    def _columns_of(_table):
+        return {
+            c["columnName"].lower(): Cdict({
+                "col_name": c["columnName"],
+                **c
+            })
+            for c in current_schema if
+            c["tableName"] == _table
+        }
+
+    for table, values in final_schema.items():
+        current_columns = _columns_of(table)
+
+        if table not in current_tables:
+            if (
+                    values.get("previous_name") and
+                    values["previous_name"] in current_tables
+            ):
+                # need to rename table previous_name to table
+                plan.add(
+                    table, "rename_table",
+                    statement=f"ALTER TABLE {values['previous_name']} "
+                              f"RENAME TO {table}"
+                )
+                current_columns = _columns_of(values["previous_name"])
+            else:
+                # got no existing table: create it
+                plan.add(
+                    table, "create_table",
+                    statement=f"CREATE TABLE {table}({values['content']})"
+                )
+                continue
+        # table exists loop for each column
+        col_got = []
+        for f_col in values["columns"]:
+            col_name, col_type, extra = (
+                f_col["col_name"], f_col["type"], f_col["extra"]
+            )
+
+            if col_name.lower() not in current_columns:
+                _prev_name = (f_col.get("previous_name") or "").lower()
+                if _prev_name in current_columns:
+                    # need to rename
+                    plan.add(
+                        table, "rename_column",
+                        clause=f"RENAME COLUMN {f_col['previous_name']} "
+                               f"TO {col_name}"
+                    )
+                    col_got.append(_prev_name)
+                    _update_field(current_columns[_prev_name], f_col, table)
+                    continue
+                # got new columns create it
+                plan.add(
+                    table, "add_column",
+                    clause=f"ADD COLUMN {col_name} {col_type} {extra}"
+                )
+            else:
+                # column exists
+                col_got.append(col_name.lower())
+                _update_field(
+                    current_columns[col_name.lower()], f_col, table
+                )
+
+        for col in current_columns:
+            if col not in col_got:
+                plan.add(table, "drop_column", clause=f"DROP COLUMN {col}")
+
+    if current_indexes is not None:
+        _plan_indexes(
+            plan, final_schema, current_indexes,
+            drop_unknown=drop_unknown_indexes
+        )
+    return plan
+
+
+def _plan_indexes(
+        plan: MigrationPlan, final_schema, current_indexes, drop_unknown=False
+):
+    created = set(
+        op.table for op in plan.operations if op.action == "create_table"
+    )
+    renamed = {
+        op.table: final_schema[op.table]["previous_name"]
+        for op in plan.operations if op.action == "rename_table"
+    }
+    concurrently = plan.sgbd_name in _concurrent_index
+    existing = {}
+    for index in current_indexes:
+        existing.setdefault(index["tableName"], {})[
+            index["indexName"].lower()
+        ] = index
+
+    for table, values in final_schema.items():
+        indexes = values.get("indexes") or []
+        if table in created:
+            # the table is empty: no need to build the index concurrently
+            for index in indexes:
+                plan.add(
+                    table, "create_index", statement=_index_statement(index)
+                )
+            continue
+        table_indexes = existing.get(renamed.get(table, table), {})
+        # CREATE/DROP INDEX CONCURRENTLY can't run in a transaction
+        kwargs = {"transactional": not concurrently}
+        _drop = "DROP INDEX " + (
+            "CONCURRENTLY " if concurrently else ""
+        ) + "IF EXISTS "
+        declared = set()
+        for index in indexes:
+            name = index["name"].lower()
+            declared.add(name)
+            current = table_indexes.get(name)
+            if current is not None:
+                current_def = parse_index(current["definition"] or "")
+                if (
+                        current_def is not None and
+                        int(current.get("valid", 1) or 0) and
+                        _index_signature(current_def) ==
+                        _index_signature(index)
+                ):
+                    continue
+                plan.add(
+                    table, "drop_index", statement=_drop + index["name"],
+                    **kwargs
+                )
+            plan.add(
+                table, "create_index",
+                statement=_index_statement(index, concurrently=concurrently),
+                **kwargs
+            )
+        if not drop_unknown:
+            continue
+        for name, current in table_indexes.items():
+            if name not in declared:
+                plan.add(
+                    table, "drop_index",
+                    statement=_drop + current["indexName"], **kwargs
+                )
+
+
+if __name__ == "__main__":
+    pass
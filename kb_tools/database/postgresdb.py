@@ -1,5 +1,12 @@
 # -*- coding: utf-8 -*-
+import contextlib
+import datetime
+import decimal
+import io
+import itertools
+import json
 import re
+import zlib
 
 import psycopg2
 
@@ -49,6 +56,75 @@ def parse_script(script, params=None, _quotes_list=('"', "'")):
     return ss.format(**quotes), params
 
 
+# python type of the values of the postgres type oids (cursor.description)
+_type_codes = {
+    16: bool,
+    17: bytes,
+    20: int,
+    21: int,
+    23: int,
+    114: dict,
+    700: float,
+    701: float,
+    1082: datetime.date,
+    1083: datetime.time,
+    1114: datetime.datetime,
+    1184: datetime.datetime,
+    1700: decimal.Decimal,
+    3802: dict,
+}
+
+# names of the server side cursors
+_cursor_ids = itertools.count()
+
+
+def _array_literal(values):
+    """The postgres array literal of a list: {1,2} or {"a","b c",NULL}"""
+    items = []
+    for value in values:
+        if value is None:
+            items.append("NULL")
+        elif isinstance(value, (list, tuple)):
+            items.append(_array_literal(value))
+        else:
+            if isinstance(value, bool):
+                value = "t" if value else "f"
+            elif isinstance(value, dict):
+                value = json.dumps(value)
+            items.append(
+                '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') +
+                '"'
+            )
+    return "{" + ",".join(items) + "}"
+
+
+def _copy_value(value, array=False):
+    """
+    Format a value for COPY ... FROM STDIN (text format). The lists are
+    given as json, or as array literals for the array columns (array)
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "\\\\x" + bytes(value).hex()
+    if array and isinstance(value, (list, tuple)):
+        value = _array_literal(value)
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return (
+        str(value).replace("\\", "\\\\").replace("\t", "\\t")
+        .replace("\n", "\\n").replace("\r", "\\r")
+    )
+
+
+def _is_array_type(column_type):
+    # information_schema gives ARRAY, the declared types int[], text[] ...
+    column_type = str(column_type or "").strip().lower()
+    return column_type == "array" or column_type.endswith("]")
+
+
 class PostgresDB(BaseDB):
     DEFAULT_PORT = 5432
 
@@ -129,15 +205,137 @@ class PostgresDB(BaseDB):
             where tables.tableName=f.tableName
         """,
             dict_res=True,
+            primary=True,
         )
         for f in fields:
             default = str(f["columnDefault"]).lower()
             if re.match("nextval\(.*\)", default):
-                f.columnDefault = None
+                f["columnDefault"] = None
             elif re.match("null(::[\w\s]*)?", default):
-                f.columnDefault = None
+                f["columnDefault"] = None
         return fields
 
+    @property
+    def get_indexes(self):
+        return self.run_script(
+            """
+            SELECT
+                i.indexname AS indexName,
+                i.tablename AS tableName,
+                i.indexdef AS definition,
+                CASE WHEN x.indisvalid THEN 1 ELSE 0 END AS valid
+            FROM pg_indexes i
+                JOIN pg_class c ON c.relname = i.indexname
+                JOIN pg_namespace n
+                    ON n.oid = c.relnamespace AND n.nspname = i.schemaname
+                JOIN pg_index x ON x.indexrelid = c.oid
+            WHERE i.schemaname NOT IN ('pg_catalog', 'information_schema')
+                AND NOT EXISTS (
+                    SELECT 1 FROM pg_constraint ct WHERE ct.conindid = c.oid
+                )
+        """,
+            dict_res=True,
+            primary=True,
+        )
+
+    def bulk_insert(self, table_name, columns, rows, cursor=None):
+        """
+        Insert the rows with COPY FROM STDIN, see BaseDB.bulk_insert. The
+        lists are formatted from the type of their column (see
+        _copy_value), known by the coercion plan of the table
+        """
+        if not rows:
+            return 0
+        plan = self._coercion_plan(table_name)
+        arrays = [
+            plan is not None and _is_array_type(
+                (plan.columns.get(str(c).lower()) or {}).get("type")
+            )
+            for c in columns
+        ]
+        data = io.StringIO(
+            "".join(
+                "\t".join(
+                    _copy_value(v, array=a) for v, a in zip(row, arrays)
+                ) + "\n"
+                for row in rows
+            )
+        )
+        if not self._is_connected():
+            self.reload_connexion()
+        (cursor or self.get_cursor()).copy_expert(
+            f"COPY {table_name} ({', '.join(columns)}) FROM STDIN", data
+        )
+        return len(rows)
+
+    def _stream_batches(self, script, params=None, batch_size=None):
+        """
+        Read the request with a named (server side) cursor: only the
+        current batch is in memory, see BaseDB._stream_batches
+        """
+        batch_size = int(batch_size or self.MAX_BUFFER_INSERTING_SIZE)
+        if not self._is_connected():
+            self.reload_connexion()
+        cursor = self.db_object.cursor(
+            name="kb_tools_batches_%d" % next(_cursor_ids)
+        )
+        cursor.itersize = batch_size
+        try:
+            self.execute(cursor, script, params=params)
+            rows = cursor.fetchmany(batch_size)
+            # the description of a named cursor is known after a fetch
+            description = self._get_cursor_description(cursor)
+            yield description, rows
+            while rows:
+                rows = cursor.fetchmany(batch_size)
+                if rows:
+                    yield description, rows
+        finally:
+            try:
+                cursor.close()
+            except psycopg2.Error:
+                pass
+            if self.auto_commit:
+                # end the read transaction of the named cursor
+                self.rollback()
+
+    @contextlib.contextmanager
+    def no_transaction(self):
+        self.commit()
+        if not self._is_connected():
+            self.reload_connexion()
+        self.db_object.autocommit = True
+        try:
+            yield
+        finally:
+            self.db_object.autocommit = False
+
+    @contextlib.contextmanager
+    def migration_lock(self):
+        key = zlib.crc32(self.MIGRATION_TABLE.encode("utf-8"))
+        self.run_script(
+            "SELECT pg_advisory_lock(%s)", params=(key,), retrieve=False,
+            primary=True
+        )
+        try:
+            with super().migration_lock():
+                yield
+        except Exception:
+            self.rollback()
+            raise
+        finally:
+            self.run_script(
+                "SELECT pg_advisory_unlock(%s)", params=(key,),
+                retrieve=False, ignore_error=True, primary=True
+            )
+            self.commit()
+
+    def cancel(self):
+        try:
+            self.db_object.cancel()
+        except (AttributeError, psycopg2.Error, Exception):
+            pass
+
     def _is_connected(self):
         try:
             return not self.db_object.closed
@@ -161,10 +359,14 @@ class PostgresDB(BaseDB):
             password: str, the password
             db_name: str, the database name
             port:
+            connect_timeout: int, max seconds to wait for the connection
 
         Returns: psycopg2.connection object
 
         """
+        options = {}
+        if kwargs.get("connect_timeout"):
+            options["connect_timeout"] = int(kwargs["connect_timeout"])
         try:
             return psycopg2.connect(
                 host=host,
@@ -172,6 +374,7 @@ class PostgresDB(BaseDB):
                 dbname=db_name,
                 password=password,
                 port=port,
+                **options
             )
         except Exception as ex:
             ex.args = [
@@ -222,7 +425,11 @@ class PostgresDB(BaseDB):
 
     @staticmethod
     def _get_cursor_description(cursor):
-        return Cdict(columns=[desc[0] for desc in cursor.description or []])
+        description = cursor.description or []
+        return Cdict(
+            columns=[desc[0] for desc in description],
+            types=[_type_codes.get(desc[1]) for desc in description]
+        )
 
     @staticmethod
     def prepare_insert_data(data: dict):
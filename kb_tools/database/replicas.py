@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Routing of the read only requests to the read replicas of a database
+"""
+from __future__ import annotations
+
+import itertools
+import re
+import threading
+import time
+
+_comment_reg = re.compile(r"--[^\n]*|/\*.*?\*/", flags=re.S)
+_read_start_reg = re.compile(r"^[\s(]*(select|with|show|values)\b", flags=re.I)
+_write_reg = re.compile(
+    r"\b(insert|update|delete|merge|into|create|alter|drop|truncate|grant|"
+    r"nextval|setval|lock|for\s+(?:no\s+key\s+)?update|for\s+(?:key\s+)?"
+    r"share|pg_advisory\w*)\b",
+    flags=re.I
+)
+_quoted_reg = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+_call_reg = re.compile(r"(\w+)\s*\(")
+# the keywords followed by a parenthesis and the functions known to only
+# read: any other function call (user function, lock, ...) may write
+_read_only_calls = frozenset((
+    "select", "from", "join", "in", "exists", "any", "all", "some", "as",
+    "on", "using", "over", "filter", "within", "values", "and", "or",
+    "not", "when", "then", "else", "is", "like", "ilike", "between",
+    "union", "intersect", "except", "lateral", "case", "where", "having",
+    "partition", "by", "array", "row", "cast", "extract", "count", "sum",
+    "avg", "min", "max", "coalesce", "nullif", "greatest", "least",
+    "lower", "upper", "length", "char_length", "trim", "ltrim", "rtrim",
+    "substr", "substring", "replace", "concat", "concat_ws", "position",
+    "left", "right", "round", "floor", "ceil", "ceiling", "abs", "now",
+    "date_trunc", "date_part", "to_char", "to_date", "to_timestamp",
+    "row_number", "rank", "dense_rank", "lag", "lead", "first_value",
+    "last_value", "string_agg", "array_agg", "json_agg", "jsonb_agg",
+    "bool_and", "bool_or", "unnest", "generate_series", "ifnull",
+    "strftime", "date", "datetime", "julianday", "instr", "printf",
+    "char", "varchar", "numeric", "decimal", "timestamp",
+))
+
+
+def is_read_only(script):
+    """
+    Check if the script only reads data: a SELECT (or WITH) request
+    without any data modifying keyword, row lock, sequence call or call
+    of a function which is not known to only read (SELECT my_func() may
+    write): use run_script(..., primary=True) for the others.
+    """
+    if not isinstance(script, str):
+        return False
+    script = _comment_reg.sub(" ", script)
+    if ";" in script.strip().rstrip(";"):
+        # many requests
+        return False
+    if (
+            _read_start_reg.match(script) is None or
+            _write_reg.search(script) is not None
+    ):
+        return False
+    return all(
+        name.lower() in _read_only_calls
+        for name in _call_reg.findall(_quoted_reg.sub("''", script))
+    )
+
+
+class ReplicaRouter:
+    """
+    Choose the replica to use for the next read request
+    Args:
+        replicas: list of BaseDB objects
+        strategy: str, round_robin or least_latency
+        sticky_after_write: float, during this number of seconds after a
+            write all the requests go to the primary (read your writes)
+    """
+    STRATEGIES = ("round_robin", "least_latency")
+    # smoothing factor of the replicas latency
+    LATENCY_ALPHA = 0.2
+
+    def __init__(self, replicas, strategy="round_robin",
+                 sticky_after_write=0.0):
+        assert strategy in self.STRATEGIES, (
+            "Bad replica strategy %s given" % strategy
+        )
+        assert replicas, "Required at least one replica"
+        self.replicas = list(replicas)
+        self.strategy = strategy
+        self.sticky_after_write = float(sticky_after_write or 0)
+        self._cycle = itertools.cycle(range(len(self.replicas)))
+        self._latency = [None] * len(self.replicas)
+        self._last_write = None
+        self._lock = threading.Lock()
+
+    def mark_write(self):
+        self._last_write = time.monotonic()
+
+    def in_sticky_window(self):
+        return (
+                self._last_write is not None and
+                time.monotonic() - self._last_write < self.sticky_after_write
+        )
+
+    def pick(self):
+        with self._lock:
+            if self.strategy == "least_latency":
+                # the replicas never measured are tried first
+                index = min(
+                    range(len(self.replicas)),
+                    key=lambda i: (
+                        -1 if self._latency[i] is None else self._latency[i]
+                    )
+                )
+            else:
+                index = next(self._cycle)
+        return self.replicas[index]
+
+    def record(self, replica, elapsed):
+        index = self.replicas.index(replica)
+        with self._lock:
+            last = self._latency[index]
+            if last is None:
+                self._latency[index] = elapsed
+            else:
+                self._latency[index] = (
+                        self.LATENCY_ALPHA * elapsed +
+                        (1 - self.LATENCY_ALPHA) * last
+                )
+
+    def close(self):
+        for replica in self.replicas:
+            replica.close_connection()
+
+
+if __name__ == "__main__":
+    pass
@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import contextlib
+import decimal
+import json
 import sqlite3
 import threading
 
@@ -17,6 +20,24 @@ class SQLiteDB(BaseDB):
         if self._is_connected():
             super().close_connection()
 
+    @contextlib.contextmanager
+    def migration_lock(self):
+        with super().migration_lock():
+            if not self._is_connected() or self.db_object is None:
+                self.reload_connexion()
+            if self.db_object.in_transaction:
+                self.commit()
+            # the write lock on the database file is kept until the end
+            # of the migration transaction
+            self.run_script("BEGIN IMMEDIATE", retrieve=False)
+            try:
+                yield
+            except Exception:
+                self.rollback()
+                raise
+            if self.db_object.in_transaction:
+                self.commit()
+
     @property
     def get_schema(self):
         return self.run_script(
@@ -41,7 +62,7 @@ class SQLiteDB(BaseDB):
                 fields.type,
                 tableName,
                 dflt_value AS columnDefault,
-                "notnull" AS nullable,
+                1 - "notnull" AS nullable,
                 fields.pk AS is_primary_key,
                 ft.foreign_table_name,
                 ft.foreign_column_name
@@ -53,8 +74,40 @@ class SQLiteDB(BaseDB):
                     AND tables.tableName=ft.table_name
             """,
             dict_res=True,
+            primary=True,
+        )
+
+    @property
+    def get_indexes(self):
+        return self.run_script(
+            """
+            SELECT
+                name AS indexName,
+                tbl_name AS tableName,
+                sql AS definition,
+                1 AS valid
+            FROM sqlite_master
+            WHERE type = 'index' AND sql IS NOT NULL
+            """,
+            dict_res=True,
+            primary=True,
         )
 
+    def bulk_insert(self, table_name, columns, rows, cursor=None):
+        """
+        See BaseDB.bulk_insert. sqlite3 can't bind the Decimal values (kept
+        by transfer) and the json values: they are given as text
+        """
+        rows = [
+            tuple(
+                str(v) if isinstance(v, decimal.Decimal) else
+                json.dumps(v) if isinstance(v, (dict, list)) else v
+                for v in row
+            )
+            for row in rows
+        ]
+        return super().bulk_insert(table_name, columns, rows, cursor=cursor)
+
     def last_insert_rowid_logic(self, cursor=None, table_name=None):
         if table_name is not None:
             table_name = " FROM " + str(table_name)
@@ -137,6 +190,12 @@ class SQLiteDB(BaseDB):
                 return None
             raise ex
 
+    def cancel(self):
+        try:
+            self.db_object.interrupt()
+        except (AttributeError, sqlite3.Error, Exception):
+            pass
+
     def _is_connected(self):
         return threading.current_thread().name == self._thread_name
 
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Copy the result of a request (or a table) from a database to another one
+"""
+from __future__ import annotations
+
+import datetime
+import decimal
+import re
+import time
+
+from kb_tools.database.basedb import BaseDB
+from kb_tools.tools import prefetch
+
+_table_reg = re.compile(r"^\s*(?:\w+\.)?(\w+)\s*$")
+
+_column_types = {
+    "POSTGRES": {
+        bool: "BOOLEAN",
+        int: "BIGINT",
+        float: "DOUBLE PRECISION",
+        decimal.Decimal: "NUMERIC",
+        datetime.datetime: "TIMESTAMP",
+        datetime.date: "DATE",
+        datetime.time: "TIME",
+        bytes: "BYTEA",
+        dict: "JSONB",
+        list: "JSONB",
+    },
+    None: {
+        bool: "BOOLEAN",
+        int: "INTEGER",
+        float: "REAL",
+        decimal.Decimal: "NUMERIC",
+        datetime.datetime: "TIMESTAMP",
+        datetime.date: "DATE",
+        datetime.time: "TIME",
+        bytes: "BLOB",
+        dict: "JSON",
+        list: "JSON",
+    },
+}
+
+
+def column_type(value, sgbd_name=None, python_type=None):
+    """
+    The type of a column holding values like value, or of python_type
+    when value is None (TEXT by default)
+    """
+    types = _column_types.get(sgbd_name) or _column_types[None]
+    if value is not None or python_type is None:
+        python_type = type(value)
+    # the most specific type first: bool is an int, datetime a date
+    for _type in python_type.__mro__:
+        if _type in types:
+            return types[_type]
+    return "TEXT"
+
+
+def create_table_script(
+        table_name, columns, rows, sgbd_name=None, python_types=None
+):
+    """
+    Build the CREATE TABLE script of a table holding the rows, the type of
+    each column is given by its first not null value, or by python_types
+    (the types of the source columns when the driver gives them) when it
+    has no value
+    """
+    types = []
+    for i, _ in enumerate(columns):
+        value = next((r[i] for r in rows if r[i] is not None), None)
+        types.append(
+            column_type(
+                value, sgbd_name,
+                python_type=python_types[i] if python_types else None
+            )
+        )
+    return (
+        f"CREATE TABLE IF NOT EXISTS {table_name} (" +
+        ", ".join(f"{c} {t}" for c, t in zip(columns, types)) + ")"
+    )
+
+
+def _thread_safe_source(db_object: BaseDB):
+    # a sqlite memory database can't be opened again in another thread
+    return not (
+        db_object.__class__.__module__.endswith("sqlitedb") and
+        str(db_object._kwargs.get("file_name") or ":memory:") == ":memory:"
+    )
+
+
+def _read_batches(src_db: BaseDB, script, params, batch_size, dedicated):
+    # run in the reader thread: its own connection to the source
+    db_object = src_db.__class__(**src_db._kwargs) if dedicated else src_db
+    try:
+        # raw rows (Decimal kept) read with a server side cursor when the
+        # driver has one, see BaseDB._stream_batches
+        yield from db_object._stream_batches(
+            script, params=params, batch_size=batch_size
+        )
+    finally:
+        if dedicated:
+            db_object.close_connection()
+
+
+def transfer(
+        src_db: BaseDB, query_or_table, dst_db: BaseDB, dst_table=None,
+        params=None, *, batch_size=None, queue_size=4, create_table=False,
+        truncate=False
+):
+    """
+    Copy the rows of a request (or a table) of src_db in dst_db. A reader
+    thread fetches the batches in a bounded queue while the current thread
+    writes them with dst_db.bulk_insert (COPY for postgres), so the
+    transfer takes about max(read, write) instead of their sum.
+    Examples:
+        >>> transfer(pg_db, "sales", sqlite_db, create_table=True)
+        >>> transfer(pg_db, "SELECT * FROM sales WHERE year = %s",
+        ...          sqlite_db, "sales_2020", params=(2020,))
+    Args:
+        src_db: BaseDB, the source database. The reader uses its own
+            connection (a sqlite memory database is read without thread)
+        query_or_table: str, a table name or a request
+        dst_db: BaseDB, the destination database
+        dst_table: str, the destination table, default the source table
+        params: the request params
+        batch_size: int, the number of rows by batch, default
+            src_db.MAX_BUFFER_INSERTING_SIZE
+        queue_size: int, the max number of batches waiting to be written
+        create_table: bool, create the destination table when it doesn't
+            exist, from the request columns and the types of the values of
+            the first batch (or of the source columns)
+        truncate: bool, delete the rows of the destination table first
+
+    Returns:
+        int, the number of rows copied
+    """
+    table = _table_reg.match(query_or_table)
+    if table is not None:
+        script = f"SELECT * FROM {query_or_table.strip()}"
+        dst_table = dst_table or table.groups()[0]
+    else:
+        script = query_or_table
+    assert dst_table, "Required argument dst_table"
+    batch_size = int(batch_size or src_db.MAX_BUFFER_INSERTING_SIZE)
+
+    dedicated = _thread_safe_source(src_db)
+    batches = _read_batches(src_db, script, params, batch_size, dedicated)
+    if dedicated:
+        batches = prefetch(batches, size=queue_size)
+
+    start = time.perf_counter()
+    auto_commit = dst_db.auto_commit
+    dst_db.auto_commit = False
+    if dst_db._router is not None:
+        dst_db._router.mark_write()
+    cursor = dst_db.get_cursor()
+    total = 0
+    first = True
+    try:
+        for description, rows in batches:
+            columns = description.columns
+            if first:
+                first = False
+                # with an empty result, the table is created from the
+                # source columns
+                if create_table:
+                    dst_db.run_script(
+                        create_table_script(
+                            dst_table, columns, rows, dst_db.name.upper(),
+                            python_types=description.get("types")
+                        ),
+                        retrieve=False
+                    )
+                if truncate:
+                    dst_db.run_script(
+                        f"DELETE FROM {dst_table}", retrieve=False
+                    )
+            total += dst_db.bulk_insert(dst_table, columns, rows, cursor)
+    except Exception:
+        dst_db.rollback()
+        raise
+    else:
+        dst_db.commit()
+    finally:
+        dst_db.auto_commit = auto_commit
+    dst_db.log_info(
+        "%d rows copied in %s in %.3fs" % (
+            total, dst_table, time.perf_counter() - start
+        )
+    )
+    return total
+
+
+if __name__ == "__main__":
+    pass
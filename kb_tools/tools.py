@@ -1,19 +1,30 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import atexit
+import functools
+import gzip
+import itertools
 import json
 import keyword
+import math
+import operator
 import os
 import random
 import re
 import shutil
 import string
 import sys
+import tempfile
+import threading
 import time
 import traceback
 import unicodedata
+import weakref
 import zipfile
 import tarfile
+from collections import deque
+from collections.abc import Mapping
 
 try:
     import Levenshtein as Lev
@@ -81,6 +92,112 @@ def read_json_file(path, default=None) -> dict | list:
         return default
 
 
+def _open_json_lines(path):
+    if hasattr(path, "read"):
+        return path, False
+    with open(path, "rb") as file:
+        compressed = file.read(2) == b"\x1f\x8b"
+    return (gzip.open if compressed else open)(path, "rb"), True
+
+
+def _parse_json_lines(lines, first_line=1, path=None):
+    records = []
+    for i, line in enumerate(lines, first_line):
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError as ex:
+            raise ValueError(
+                "Bad json at the line %d of %s: %s" % (i, path, ex)
+            ) from None
+    return records
+
+
+def iter_json_lines(
+        path, batch_size=None, processes=None, cdict=True, chunk_size=10000
+):
+    """
+    Read a JSON Lines file (a json document by line, gzip compressed or
+    not) one record at a time: the memory used doesn't depend on the size
+    of the file.
+    Examples:
+        >>> for event in iter_json_lines("events.jsonl.gz"):
+        ...     print(event.user.id)
+        >>> for records in iter_json_lines("events.jsonl", batch_size=5000):
+        ...     insert(records)
+    Args:
+        path: str, the file path, or a file object
+        batch_size: int, yield lists of batch_size records instead of the
+            records
+        processes: int, the number of processes parsing the lines by
+            chunks of chunk_size lines, default the current process
+        cdict: bool, get Cdict records (lazy: see Cdict.LAZY) instead of
+            dicts
+        chunk_size: int, the number of lines by process task
+
+    Returns:
+        generator of records, or of lists of records with batch_size
+    """
+    file, close = _open_json_lines(path)
+    name = getattr(file, "name", path)
+    try:
+        lines = iter(file)
+        if processes and processes > 1:
+            chunks = _parse_json_lines_pool(lines, processes, chunk_size, name)
+        else:
+            chunks = (
+                _parse_json_lines(chunk, first_line, name)
+                for first_line, chunk in _line_chunks(
+                    lines, batch_size or chunk_size
+                )
+            )
+        records = itertools.chain.from_iterable(chunks)
+        if cdict:
+            records = (
+                Cdict(r, _Cdict__lazy=True) if isinstance(r, dict) else r
+                for r in records
+            )
+        if not batch_size:
+            yield from records
+            return
+        batch_size = max(int(batch_size), 1)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                return
+            yield batch
+    finally:
+        if close:
+            file.close()
+
+
+def _line_chunks(lines, size):
+    first_line = 1
+    while True:
+        chunk = list(itertools.islice(lines, size))
+        if not chunk:
+            return
+        yield first_line, chunk
+        first_line += len(chunk)
+
+
+def _parse_json_lines_pool(lines, processes, chunk_size, name):
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(processes) as executor:
+        # at most 2 chunks by process in memory, yielded in order
+        pending = deque()
+        for first_line, chunk in _line_chunks(lines, chunk_size):
+            pending.append(
+                executor.submit(_parse_json_lines, chunk, first_line, name)
+            )
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
 def get_func_args(func):
     while hasattr(func, "__wrapped__"):
         func = func.__wrapped__
@@ -142,35 +259,134 @@ def extract_file(
             getattr(open_obj, method)(**kwargs)
 
 
-def generate_candidate(a, *args):
-    def _eq(self, o):
-        for index, i in enumerate((a, *args)):
-            if isinstance(i, re.Pattern):
-                if i.match(o):
-                    self.last_index = index
-                    return True
-            elif "%" in i:
-                reg = "^" + re.escape(i).replace("%", ".*?") + "$"
-                if re.match(reg, o, flags=re.I | re.S):
-                    self.last_index = index
-                    return True
+class CandidateSet:
+    """
+    Set of candidates equal to a value matching one of them, tried in
+    order: a re.Pattern (match), a str with % wildcards (case insensitive
+    full match) or a name (same as Var(value) == name). The index of the
+    first matching candidate is kept in last_index.
+    The wildcards are compiled once in a single pattern (a named group by
+    candidate) and the names are found with a dict of their normalized
+    form.
+        >>> candidates = CandidateSet("id", "%date%", re.compile(r"\\d+"))
+        >>> candidates == "Creation Date", candidates.last_index
+        (True, 1)
+    """
+    __hash__ = None
+
+    def __init__(self, *candidates):
+        self.candidates = candidates
+        self.last_index = len(candidates)
+        self._exact = {}
+        self._normalized = {}
+        self._patterns = []
+        self._first_wildcard = len(candidates)
+        wildcards = []
+        for index, candidate in enumerate(candidates):
+            if isinstance(candidate, re.Pattern):
+                self._patterns.append((index, candidate))
+            elif "%" in candidate:
+                self._first_wildcard = min(self._first_wildcard, index)
+                wildcards.append(
+                    "(?P<c%d>%s)" % (
+                        index, re.escape(candidate).replace("%", ".*?")
+                    )
+                )
             else:
-                if Var(o) == i:
-                    self.last_index = index
-                    return True
-        return False
+                self._exact.setdefault(str(candidate), index)
+                self._normalized.setdefault(_normalize_key(candidate), index)
+        # the alternatives are tried in order: the group found is the one
+        # of the first matching wildcard
+        self._wildcards = None
+        if wildcards:
+            self._wildcards = re.compile(
+                "^(?:" + "|".join(wildcards) + ")$", flags=re.I | re.S
+            )
+
+    def match(self, value):
+        """
+        Get the index of the first candidate matching value, None if no
+        one matches
+        """
+        text = value if isinstance(value, str) else str(value)
+        found = [
+            i for i in (
+                self._exact.get(text),
+                self._normalized.get(_normalize_key(text)),
+            )
+            if i is not None
+        ]
+        best = min(found) if found else len(self.candidates)
+        if self._first_wildcard < best:
+            res = self._wildcards.match(text)
+            if res is not None:
+                best = min(best, int(res.lastgroup[1:]))
+        for index, pattern in self._patterns:
+            if index >= best:
+                break
+            if pattern.match(text):
+                best = index
+                break
+        return best if best < len(self.candidates) else None
+
+    def match_series(self, series):
+        """
+        Get the index of the first candidate matching each value of series
+        (<NA> if no one matches, and for the null values). Each distinct
+        value is matched once.
+        Args:
+            series: pandas.Series
+
+        Returns:
+            pandas.Series of Int64, with the index of series
+        """
+        import pandas
+
+        uniques = pandas.Series(series.dropna().unique())
+        texts = uniques.astype(str)
+        size = len(self.candidates)
+        best = pandas.Series(size, index=uniques.index, dtype="int64")
+        if self._exact or self._normalized:
+            for found in (
+                    texts.map(self._exact),
+                    texts.map(_normalize_key).map(self._normalized),
+            ):
+                best = best.where(found.isna() | (found >= best), found)
+        if self._wildcards is not None:
+            groups = texts.str.extract(self._wildcards)
+            for name in groups.columns:
+                index = int(name[1:])
+                best = best.where(
+                    groups[name].isna() | (best <= index), index
+                )
+        for index, pattern in self._patterns:
+            matched = texts.str.match(pattern)
+            best = best.where(~matched | (best <= index), index)
+        best = best.astype("Int64").where(best < size)
+        mapping = dict(zip(uniques, best))
+        return series.map(mapping).astype("Int64")
+
+    def __eq__(self, other):
+        index = self.match(other)
+        if index is None:
+            return False
+        self.last_index = index
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(self.candidates[0])
 
-    obj = type(
-        "candidate",
-        (),
-        {
-            "last_index": len((a, *args)),
-            "__eq__": _eq,
-            "__neq__": lambda self, o: not self.__eq__(o),
-            "__repr__": lambda s: repr(a)
-        },
-    )
-    return obj()
+
+def generate_candidate(a, *args):
+    """
+    Get the CandidateSet of the candidates a, *args
+        >>> generate_candidate("%date%pass") == "date_de_modif_mot_de_pass"
+        True
+    """
+    return CandidateSet(a, *args)
 
 
 def rename_file(path_to_last_file, new_name, *, use_origin_folder=False):
@@ -216,6 +432,107 @@ def remove_accent_from_text(text):
     return str(text)
 
 
+def map_distinct(
+        values, func, null=None, processes=None, chunk_size=200000
+):
+    """
+    Get func(value) of each value of a pandas Series or a list, computed
+    once by distinct str(value) and spread back to the rows: the columns
+    of names, emails, phone numbers ... repeat their values.
+    Args:
+        values: pandas.Series | list
+        func: function of a value, picklable when processes is given
+        null: the result of the null values (None, NaN), func is not called
+        processes: int, the number of processes sharing the distinct
+            values by chunks of chunk_size, default all in the current
+            process
+        chunk_size: int, the number of distinct values by process task
+
+    Returns:
+        pandas.Series (with the index and the name of values) | list
+    """
+    import numpy
+    import pandas
+
+    series = values
+    if not isinstance(values, pandas.Series):
+        series = pandas.Series(list(values), dtype=object)
+    # the null values keep the code -1: with pandas < 3, astype(str) gives
+    # them the strings 'None' and 'nan'
+    null_mask = series.isna().to_numpy()
+    codes = numpy.full(len(series), -1, dtype=numpy.intp)
+    uniques = []
+    if not null_mask.all():
+        not_null = series[~null_mask]
+        # by str: 1 and 1.0 are not the same value for func
+        not_null_codes, _ = pandas.factorize(not_null.astype(str))
+        codes[~null_mask] = not_null_codes
+        # func gets the first value of each distinct str
+        _, first = numpy.unique(not_null_codes, return_index=True)
+        uniques = not_null.iloc[first].tolist()
+    if processes and processes > 1 and len(uniques) > chunk_size:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(processes) as executor:
+            results = list(
+                itertools.chain.from_iterable(
+                    executor.map(
+                        _map_values,
+                        itertools.repeat(func),
+                        get_buffer(uniques, chunk_size, vv=False),
+                    )
+                )
+            )
+    else:
+        results = _map_values(func, uniques)
+    # the code -1 of the null values takes the last item
+    results.append(null)
+    array = numpy.empty(len(results), dtype=object)
+    array[:] = results
+    array = array[codes]
+    if not isinstance(values, pandas.Series):
+        return array.tolist()
+    result = pandas.Series(
+        array, index=series.index, name=series.name, dtype=object
+    )
+    if all(isinstance(r, bool) for r in results):
+        result = result.astype(bool)
+    return result
+
+
+def _map_values(func, values):
+    return [func(v) for v in values]
+
+
+def remove_accent_from_text_series(
+        values, processes=None, chunk_size=200000
+):
+    """
+    remove_accent_from_text of each value of a Series or list (None for
+    the nulls), once by distinct value
+    """
+    return map_distinct(
+        values, remove_accent_from_text, processes=processes,
+        chunk_size=chunk_size,
+    )
+
+
+# the size of the caches of the normalized names (format_var_name, Var)
+NAME_CACHE_SIZE = 1 << 16
+
+_KEYWORDS = tuple(keyword.kwlist)
+_digits_reg = re.compile(r"^\d*$")
+_camel_reg = re.compile("(?<=[a-z])([A-Z])")
+_lead_digits_reg = re.compile(r"^(\d+)")
+
+
+@functools.lru_cache(maxsize=None)
+def _not_permitted_reg(accent, permit_char):
+    reg = r"\w\d_" if accent else r"a-zA-Z\d"
+    reg += re.escape(permit_char)
+    return re.compile("[^" + reg + "]", flags=re.I)
+
+
 def format_var_name(
     name,
     sep="_",
@@ -225,39 +542,62 @@ def format_var_name(
     remove_accent=False,
     min_length_word=1,
     no_case=False,
-    blacklist=keyword.kwlist,
+    blacklist=_KEYWORDS,
+):
+    if blacklist and not isinstance(blacklist, (tuple, str)):
+        blacklist = tuple(blacklist)
+    return _format_var_name(
+        str(name), sep, accent, "".join(permit_char or ""), str(default),
+        remove_accent, min_length_word, no_case, blacklist or None
+    )
+
+
+def format_var_name_series(
+        values, processes=None, chunk_size=200000, **kwargs
 ):
-    if re.match(r"^\d*$", str(name)):
-        return str(default)
-    origin = str(name).strip()
+    """
+    format_var_name(value, **kwargs) of each value of a Series or list
+    (None for the nulls), once by distinct value
+    """
+    return map_distinct(
+        values, functools.partial(format_var_name, **kwargs),
+        processes=processes, chunk_size=chunk_size,
+    )
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def _format_var_name(
+        name, sep, accent, permit_char, default, remove_accent,
+        min_length_word, no_case, blacklist
+):
+    # the work of format_var_name, the args made hashable
+    if _digits_reg.match(name):
+        return default
+    origin = name.strip()
     name = origin
 
     # camel name --> camelName
-    name = re.sub("(?<=[a-z])([A-Z])", r"_\1", name)
+    name = _camel_reg.sub(r"_\1", name)
     if name != origin:
         no_case = True
 
     if no_case:
         name = name.lower()
-    if accent:
-        reg = r"\w\d_"
-    else:
-        if remove_accent:
-            try:
-                name = remove_accent_from_text(name)
-            except (ValueError, Exception):
-                pass
-        reg = r"a-zA-Z\d"
-    reg += re.escape("".join(permit_char or ""))
-    reg = "[^" + reg + "]"
+    if not accent and remove_accent:
+        try:
+            name = remove_accent_from_text(name)
+        except (ValueError, Exception):
+            pass
     name = sep.join(
         [
             p
-            for p in re.sub(reg, " ", name, flags=re.I).strip().split()
+            for p in _not_permitted_reg(accent, permit_char).sub(
+                " ", name
+            ).strip().split()
             if p and len(p) >= min_length_word
         ]
     )
-    name = sep.join([x for x in re.split(r"^(\d+)", name)[::-1] if x])
+    name = sep.join([x for x in _lead_digits_reg.split(name)[::-1] if x])
 
     if blacklist:
         if no_case:
@@ -267,6 +607,17 @@ def format_var_name(
     return name
 
 
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def _var_key(text, default, remove_accent, no_case):
+    # the form compared by Var.__eq__
+    key = format_var_name(
+        text, default=default, remove_accent=remove_accent
+    ).replace("_", "")
+    if no_case:
+        key = key.lower()
+    return key
+
+
 def lev_calculate(str1, str2):
     dist = Lev.distance(str1, str2)
     r = Lev.ratio(str1, str2)
@@ -292,12 +643,9 @@ class Var(str):
         self._no_case = no_case
 
         # self = cls(*args, **kwargs)
-        self._good = format_var_name(
-            self, default=default or self, remove_accent=remove_accent
-        ).replace("_", "")
-
-        if self._no_case:
-            self._good = self._good.lower()
+        self._good = _var_key(
+            str(self), str(default or self), remove_accent, no_case
+        )
         return self
 
     def __eq__(self, other):
@@ -305,11 +653,10 @@ class Var(str):
             if super().__eq__(other) == True:
                 return True
             if not isinstance(other, Var):
-                other = format_var_name(
-                    other, default=other, remove_accent=self._remove_accent
-                ).replace("_", "")
-                if self._no_case:
-                    other = other.lower()
+                other = str(other)
+                other = _var_key(
+                    other, other, self._remove_accent, self._no_case
+                )
         except AttributeError:
             return self == other
         res = self._good == other
@@ -325,8 +672,109 @@ class Var(str):
         return super().__hash__()
 
 
+def _no_callback():
+    return None
+
+
+class _WriteBehind:
+    """
+    The alter callback of a persisted Cdict (see Cdict.persist): the
+    changes are counted and a background thread writes the dict in its
+    file when no change came for delay seconds, or after max_changes
+    changes.
+    """
+
+    def __init__(self, data, file_path, delay=1.0, max_changes=100,
+                 callback=None, indent=4):
+        self._data = weakref.ref(data)
+        self.file_path = file_path
+        self.delay = delay
+        self.max_changes = max_changes
+        self.callback = callback
+        self.indent = indent
+        self._changes = 0
+        self._last_change = 0
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+
+    def __call__(self):
+        if callable(self.callback):
+            self.callback()
+        with self._condition:
+            self._changes += 1
+            self._last_change = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="cdict-write-behind", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+
+    def __reduce__(self):
+        # the copies of the dict are not persisted
+        return _no_callback, ()
+
+    def _run(self):
+        try:
+            while True:
+                with self._condition:
+                    while self._changes:
+                        wait = (
+                            self._last_change + self.delay - time.monotonic()
+                        )
+                        if self._changes >= self.max_changes or wait <= 0:
+                            break
+                        self._condition.wait(wait)
+                    if not self._changes:
+                        # the next change starts another thread
+                        self._thread = None
+                        return
+                try:
+                    self.flush()
+                except Exception:  # noqa
+                    # like a value which can't be serialized: the dict is
+                    # written again with the next change
+                    from kb_tools.customlogger import CustomLogger
+
+                    CustomLogger.get_current().exception(
+                        "Cdict write behind of %s failed" % self.file_path
+                    )
+        finally:
+            with self._condition:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+    def flush(self):
+        """Write the dict now if it has changes not written"""
+        with self._write_lock:
+            with self._condition:
+                if not self._changes:
+                    return
+                self._changes = 0
+            data = self._data()
+            if data is None:
+                return
+            try:
+                Cdict._to_json(data, self.file_path, indent=self.indent)
+            except RuntimeError:
+                # changed during the serialization: written again later
+                with self._condition:
+                    self._changes += 1
+                    self._condition.notify()
+
+
 class Cdict(dict):
     NO_CAST_CONSIDER = True
+    # wrap the nested dicts and containers only when they are read (a
+    # per instance choice with the _Cdict__lazy kwarg)
+    LAZY = False
+    # defaults of the private attributes (copy, unpickling)
+    __callback = None
+    __file_name = None
+    __lazy = False
+    __writer = None
+    __muted = False
 
     def __new__(cls, *args, **kwargs):
         data = {}
@@ -336,6 +784,7 @@ class Cdict(dict):
             data = args
         __no_parse_string = kwargs.get("_Cdict__no_parse_string", False)
         __callback = kwargs.get("_Cdict__alter_callback", None)
+        __lazy = kwargs.get("_Cdict__lazy", cls.LAZY)
         if isinstance(data, str) and not __no_parse_string:
             got = False
             try:
@@ -355,6 +804,7 @@ class Cdict(dict):
                         d,
                         _Cdict__no_parse_string=True,
                         _Cdict__alter_callback=__callback,
+                        _Cdict__lazy=__lazy,
                     )
                     for d in data
                 ]
@@ -373,6 +823,7 @@ class Cdict(dict):
                         d,
                         _Cdict__no_parse_string=True,
                         _Cdict__alter_callback=__callback,
+                        _Cdict__lazy=__lazy,
                     )
                     for d in data
                 ]
@@ -385,6 +836,7 @@ class Cdict(dict):
 
         kwargs.pop("_Cdict__no_parse_string", None)
         self.__callback = kwargs.pop("_Cdict__alter_callback", None)
+        self.__lazy = bool(kwargs.pop("_Cdict__lazy", self.LAZY))
         data = {}
         if len(args) == 1:
             data = args[0]
@@ -396,6 +848,10 @@ class Cdict(dict):
         else:
             data = kwargs
 
+        if self.__lazy:
+            # the values are wrapped at their first reading (__lazy_value)
+            super().__init__(data)
+            return
         for k in data:
             data[k] = Cdict(
                 data[k],
@@ -407,20 +863,101 @@ class Cdict(dict):
 
         super().__init__(data)
 
+    def __wrap(self, v):
+        return Cdict(
+            v,
+            _Cdict__no_parse_string=True,
+            _Cdict__alter_callback=self.__callback,
+            _Cdict__lazy=self.__lazy,
+        )
+
+    def __lazy_value(self, k, v):
+        """
+        In lazy mode, wrap the value v of the key k if it is not yet done
+        and keep the result in place of v (without the callback)
+        """
+        if not self.__lazy or isinstance(v, Cdict):
+            return v
+        if isinstance(v, (list, tuple, set)):
+            # the containers stay containers: remember those wrapped
+            wrapped = self.__dict__.setdefault("_Cdict__wrapped", set())
+            if k in wrapped:
+                return v
+            v = self.__wrap(v)
+            wrapped.add(k)
+        elif isinstance(v, dict):
+            v = self.__wrap(v)
+        else:
+            return v
+        dict.__setitem__(self, k, v)
+        return v
+
+    def __lazy_forget(self, k):
+        wrapped = self.__dict__.get("_Cdict__wrapped")
+        if wrapped:
+            wrapped.discard(k)
+
+    def __lazy_all(self):
+        if self.__lazy:
+            for k, v in list(dict.items(self)):
+                self.__lazy_value(k, v)
+
+    def values(self):
+        self.__lazy_all()
+        return super().values()
+
+    def items(self):
+        self.__lazy_all()
+        return super().items()
+
     def __callback_func(self):
+        if self.__muted:
+            return
         if callable(self.__callback):
             try:
                 self.__callback()
             except:  # noqa: E722
                 pass
 
+    def __keys_index(self):
+        """
+        The normalized key -> real keys (in insertion order) index, built
+        at the first lookup needing it and then kept up to date
+        """
+        index = self.__dict__.get("_Cdict__index")
+        if index is None:
+            index = {}
+            for k in dict.keys(self):
+                index.setdefault(_normalize_key(k), []).append(k)
+            super().__setattr__("_Cdict__index", index)
+        return index
+
+    def __index_add(self, k):
+        index = self.__dict__.get("_Cdict__index")
+        if index is not None:
+            keys = index.setdefault(_normalize_key(k), [])
+            if k not in keys:
+                keys.append(k)
+
+    def __index_remove(self, k):
+        index = self.__dict__.get("_Cdict__index")
+        if index is not None:
+            norm = _normalize_key(k)
+            keys = index.get(norm, [])
+            if k in keys:
+                keys.remove(k)
+            if not keys:
+                index.pop(norm, None)
+
+    def __index_reset(self):
+        self.__dict__.pop("_Cdict__index", None)
+
     def __parse_item(self, item):
-        for i in self.keys():
-            if self.NO_CAST_CONSIDER:
-                if Var(i) == item:
-                    return i
-            elif i == item:
-                return i
+        if not self.NO_CAST_CONSIDER or dict.__contains__(self, item):
+            return item
+        keys = self.__keys_index().get(_normalize_key(item))
+        if keys:
+            return keys[0]
         return item
 
     def to_json(self, file_path=None, indent=4, retrieve=False):
@@ -434,20 +971,96 @@ class Cdict(dict):
     @staticmethod
     def _to_json(json_data, file_path, indent=4):
         res = json.dumps(json_data, indent=indent)
-        with open(file_path, "w") as file:
-            file.write(res)
+        # written in a temporary file then renamed: the file is never
+        # seen half written
+        directory = os.path.dirname(os.path.abspath(file_path))
+        fd, tmp_path = tempfile.mkstemp(
+            dir=directory, prefix="." + os.path.basename(file_path),
+            suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as file:
+                file.write(res)
+                file.flush()
+                os.fsync(file.fileno())
+            if os.path.exists(file_path):
+                shutil.copymode(file_path, tmp_path)
+            else:
+                os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def __set_callback(self, callback):
+        self.__callback = callback
+        for v in dict.values(self):
+            for item in v if isinstance(v, (list, tuple, set)) else (v,):
+                if isinstance(item, Cdict):
+                    item.__set_callback(callback)
+
+    def persist(self, file_path=None, delay=1.0, max_changes=100, indent=4):
+        """
+        Write the dict in a json file after its changes (nested values
+        included): the changes are gathered and a background thread
+        writes the file when no change came for delay seconds, or after
+        max_changes changes. The pending changes are written at exit.
+        Args:
+            file_path: str, the json file, default the file of the dict
+            delay: float, the seconds without change before writing
+            max_changes: int, the max number of changes not written
+            indent: int, the json indent
+
+        Returns:
+            self
+        """
+        file_path = file_path or self.__file_name
+        assert file_path, "Required argument file_path"
+        callback = self.__callback
+        if self.__writer is not None:
+            atexit.unregister(self.__writer.flush)
+            callback = self.__writer.callback
+        self.__file_name = file_path
+        self.__writer = _WriteBehind(
+            self, file_path, delay=delay, max_changes=max_changes,
+            callback=callback, indent=indent
+        )
+        atexit.register(self.__writer.flush)
+        self.__set_callback(self.__writer)
+        return self
+
+    def flush(self):
+        """Write now the changes not yet written by persist"""
+        if self.__writer is not None:
+            self.__writer.flush()
+
+    def bulk_update(self, other=(), /, **kwargs):
+        """update calling the alter callback once (a single write)"""
+        self.__muted = True
+        try:
+            self.update(other, **kwargs)
+        finally:
+            self.__muted = False
+        self.__callback_func()
 
     def get(self, item, default=None):
         return getattr(self, item, default)
 
     def __getitem__(self, item):
         try:
-            return super().__getitem__(item)
+            value = super().__getitem__(item)
         except KeyError:
-            key = self.__parse_item(item)
-            return super().__getitem__(key)
+            item = self.__parse_item(item)
+            value = super().__getitem__(item)
+        return self.__lazy_value(item, value)
 
     def __getattr__(self, item, *args):
+        if str(item).startswith("_Cdict__"):
+            # private attribute not set yet (copy, unpickling)
+            raise AttributeError(item)
         try:
             return self[item]
         except KeyError:
@@ -461,27 +1074,63 @@ class Cdict(dict):
 
     def pop(self, k, *args):
         k = self.__parse_item(k)
+        if dict.__contains__(self, k):
+            self.__lazy_value(k, dict.__getitem__(self, k))
         res = super().pop(k, *args)
+        self.__index_remove(k)
+        self.__lazy_forget(k)
         self.__callback_func()
         return res
 
+    def popitem(self):
+        if self.__lazy and len(self):
+            k = next(reversed(dict.keys(self)))
+            self.__lazy_value(k, dict.__getitem__(self, k))
+        res = super().popitem()
+        self.__index_remove(res[0])
+        self.__lazy_forget(res[0])
+        self.__callback_func()
+        return res
+
+    def clear(self):
+        super().clear()
+        self.__index_reset()
+        self.__dict__.pop("_Cdict__wrapped", None)
+        self.__callback_func()
+
+    def setdefault(self, k, default=None):
+        if k not in self:
+            self[k] = default
+        return self[k]
+
     def __contains__(self, item):
-        return item in [
-            Var(k) if self.NO_CAST_CONSIDER else k for k in self.keys()
-        ] or super().__contains__(item)
+        if super().__contains__(item):
+            return True
+        if not self.NO_CAST_CONSIDER:
+            return False
+        return _normalize_key(item) in self.__keys_index()
 
     def __delitem__(self, k):
         """Delete self[key]."""
         k = self.__parse_item(k)
         super().__delitem__(k)
+        self.__index_remove(k)
+        self.__lazy_forget(k)
         self.__callback_func()
 
-    def update(self, other, **kwargs):
+    def update(self, other=(), /, **kwargs):
         if isinstance(other, dict) or hasattr(other, "items"):
             for k, v in other.items():
                 self[k] = v
         else:
-            super().update(other, **kwargs)
+            for k, v in other:
+                self[k] = v
+        for k, v in kwargs.items():
+            self[k] = v
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
 
     def __setitem__(self, k, v):
         """Set self[key] to value."""
@@ -491,89 +1140,442 @@ class Cdict(dict):
             return
 
         k = self.__parse_item(k)
-        v = Cdict(
-            v,
-            _Cdict__no_parse_string=True,
-            _Cdict__alter_callback=self.__callback,
-        )
+        v = self.__wrap(v)
         super().__setitem__(k, v)
+        self.__index_add(k)
+        if self.__lazy and isinstance(v, (list, tuple, set)):
+            self.__dict__.setdefault("_Cdict__wrapped", set()).add(k)
         self.__callback_func()
 
     def __setattr__(self, key, value):
         if str(key).startswith("_Cdict__"):
             super().__setattr__(key, value)
             return
-        value = Cdict(
-            value,
-            _Cdict__no_parse_string=True,
-            _Cdict__alter_callback=self.__callback,
-        )
+        value = self.__wrap(value)
         self.__setitem__(key, value)
         self.__callback_func()
 
 
+def _normalize_key(key):
+    # the form used by Cdict (Var) to compare the keys
+    key = str(key)
+    return _var_key(key, key, True, True)
+
+
+class RowFields:
+    """
+    The columns of a result, shared by all its rows (see Row). The
+    Cdict like lookups (case, accent and format insensitive) are resolved
+    once for the whole result.
+    """
+    __slots__ = ("columns", "index", "_aliases")
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        # like dict(zip(columns, row)): the last duplicated column wins
+        self.index = {c: i for i, c in enumerate(self.columns)}
+        self._aliases = None
+
+    def position(self, key):
+        try:
+            return self.index[key]
+        except (KeyError, TypeError):
+            pass
+        if self._aliases is None:
+            self._aliases = {}
+            for column, i in self.index.items():
+                self._aliases.setdefault(_normalize_key(column), i)
+        try:
+            return self._aliases[key]
+        except (KeyError, TypeError):
+            pass
+        i = self._aliases.get(_normalize_key(key))
+        if i is None:
+            raise KeyError(key)
+        # the next rows get it directly
+        self._aliases[key] = i
+        return i
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return "RowFields%r" % (self.columns,)
+
+
+_set_slot = object.__setattr__
+
+
+class Row(Mapping):
+    """
+    Mapping of a result row, stored as a tuple of values and the RowFields
+    shared by all the rows of the result. The keys are found like with
+    Cdict: row["Amount"], row.amount, row["montant_total"] ... The values
+    can be changed but no key can be added: it's not a dict (see to_dict)
+    """
+    __slots__ = ("_fields", "_values")
+
+    def __init__(self, fields: RowFields, values):
+        _set_slot(self, "_fields", fields)
+        _set_slot(self, "_values", tuple(values))
+
+    def __getitem__(self, key):
+        return self._values[self._fields.position(key)]
+
+    def __setitem__(self, key, value):
+        """Set the value of an existing field"""
+        values = list(self._values)
+        values[self._fields.position(key)] = value
+        _set_slot(self, "_values", tuple(values))
+
+    def __setattr__(self, key, value):
+        if key in Row.__slots__:
+            _set_slot(self, key, value)
+            return
+        try:
+            self[key] = value
+        except KeyError:
+            raise AttributeError(
+                "This attribute `%s` don't exists for this instance" % key
+            )
+
+    def __getattr__(self, item):
+        if item.startswith("__") or item in Row.__slots__:
+            raise AttributeError(item)
+        try:
+            return self[item]
+        except KeyError:
+            raise AttributeError(
+                "This attribute `%s` don't exists for this instance" % item
+            )
+
+    def __iter__(self):
+        return iter(self._fields.index)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __contains__(self, item):
+        try:
+            self._fields.position(item)
+            return True
+        except KeyError:
+            return False
+
+    def __eq__(self, other):
+        if isinstance(other, Row) and other._fields is self._fields:
+            return self._values == other._values
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return Row, (self._fields, self._values)
+
+    def copy(self):
+        return Row(self._fields, self._values)
+
+    def to_dict(self):
+        return {c: self._values[i] for c, i in self._fields.index.items()}
+
+    def __repr__(self):
+        return "Row(%r)" % (self.to_dict(),)
+
+
 def get_buffer(obj, max_buffer=200, vv=True) -> tuple | ...:
-    i = 0
-    if max_buffer != int(max_buffer):
-        max_buffer = int(max_buffer) + 1
-    if hasattr(obj, "index") and hasattr(obj, "shape"):
-        indexes = list(obj.index)
-        for i, index in get_buffer(indexes, max_buffer=max_buffer):
+    """
+    Split obj in chunks of max_buffer items.
+    DataFrames, Series and arrays are sliced by position (iloc views, no
+    copy), the sequences are sliced and any other iterable (generator,
+    cursor, ...) is consumed lazily.
+    Args:
+        obj: the object to split
+        max_buffer: int, the max size of each chunk
+        vv: bool, yield (progress, chunk) instead of chunk. progress is the
+            fraction of the items consumed (1.0 with the last chunk), or
+            None when the iterable doesn't know its size
+
+    Returns:
+        generator
+    """
+    max_buffer = max(int(math.ceil(max_buffer)), 1)
+    if hasattr(obj, "iloc"):
+        take = obj.iloc.__getitem__
+    elif hasattr(obj, "shape") or isinstance(obj, (list, tuple, str, bytes)):
+        take = obj.__getitem__
+    else:
+        total = operator.length_hint(obj, 0)
+        iterator = iter(obj)
+        consumed = 0
+        while True:
+            chunk = list(itertools.islice(iterator, max_buffer))
+            if not chunk:
+                return
+            consumed += len(chunk)
             if vv:
-                yield i, obj.loc[index]
+                yield (min(consumed / total, 1.0) if total else None), chunk
             else:
-                yield obj.loc[index]
-        return
-    else:
-        length = len
-        size = max(int(len(obj) / max_buffer), 1)
-    for i in range(size):
-        tmp = obj[i * max_buffer : (i + 1) * max_buffer]
-        if length(tmp) > max_buffer:
-            tmp = tmp[:-1]
+                yield chunk
+            if len(chunk) < max_buffer:
+                return
+
+    total = len(obj)
+    for start in range(0, total, max_buffer):
+        chunk = take(slice(start, start + max_buffer))
         if vv:
-            yield i / size, tmp
+            yield min(start + max_buffer, total) / total, chunk
         else:
-            yield tmp
-    res = obj[(i + 1) * max_buffer :]
-    if not length(res):
-        return
-    if vv:
-        yield (i + 1) / size, res
-    else:
-        yield res
+            yield chunk
 
 
-def is_file_is_used(file):
-    if sys.platform != "linux":
+def prefetch(iterable, size=2):
+    """
+    Iterate over iterable in a background thread: the next items are
+    produced while the current one is used. At most size items are kept
+    ready. The errors of the iterable are raised in the calling thread.
+    Examples:
+        >>> for chunk in prefetch(pandas.read_csv(path, chunksize=1000)):
+        ...     insert(chunk)
+    """
+    import queue
+    import threading
+
+    items = queue.Queue(maxsize=max(int(size), 1))
+    stop = threading.Event()
+
+    def _put(value):
+        while not stop.is_set():
+            try:
+                items.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce():
         try:
-            os.rename(file, file)
-            return False
-        except (OSError, Exception):
-            return True
+            for item in iterable:
+                if not _put((False, item)):
+                    return
+        except BaseException as ex:  # noqa
+            _put((True, ex))
+            return
+        _put((True, None))
+
+    threading.Thread(target=_produce, name="prefetch", daemon=True).start()
     try:
-        file = os.path.realpath(file)
-    except FileNotFoundError:
-        return False
+        while True:
+            done, value = items.get()
+            if done:
+                if value is not None:
+                    raise value
+                return
+            yield value
+    finally:
+        stop.set()
+
+
+def files_in_use(paths, stable_delay=0.1):
+    """
+    Check if files are used by a process. On Linux the descriptors of all
+    the processes (/proc/*/fd) are read once for all the paths, then the
+    csv/txt files (and those without extension) not opened are checked
+    together: a file whose size or modification time changes during
+    stable_delay seconds is being written.
+    Elsewhere a file is used when it can't be renamed.
+    Args:
+        paths: list of file paths
+        stable_delay: float, the seconds between the two stat of the files
+
+    Returns:
+        dict, path -> bool (False for the missing files)
+    """
+    result = {}
+    if sys.platform != "linux":
+        for path in paths:
+            try:
+                os.rename(path, path)
+                result[path] = False
+            except (OSError, Exception):
+                result[path] = True
+        return result
 
-    import glob
+    wanted = {}
+    for path in paths:
+        result[path] = False
+        if os.path.exists(path):
+            wanted.setdefault(os.path.realpath(path), []).append(path)
+    if not wanted:
+        return result
 
-    for fds in glob.glob("/proc/*/fd/*"):
+    remaining = set(wanted)
+    for target in _opened_files(remaining):
+        for path in wanted[target]:
+            result[path] = True
+        remaining.discard(target)
+
+    to_check = [
+        f for f in remaining
+        if os.path.splitext(f)[1].lower() in (".csv", ".txt", "")
+    ]
+    if to_check:
+        before = {f: _file_state(f) for f in to_check}
+        time.sleep(stable_delay)
+        for f in to_check:
+            state = _file_state(f)
+            if state is None or state != before[f]:
+                for path in wanted[f]:
+                    result[path] = True
+    return result
+
+
+def _file_state(path):
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return stat_result.st_size, stat_result.st_mtime_ns
+
+
+def _opened_files(targets):
+    # the targets opened by a process, /proc read until all are found
+    found = set()
+    try:
+        processes = [e.name for e in os.scandir("/proc") if e.name.isdigit()]
+    except OSError:
+        return found
+    for pid in processes:
         try:
-            if os.readlink(fds) == file:
-                return True
+            descriptors = os.scandir("/proc/%s/fd" % pid)
         except OSError:
-            pass
-    if os.path.splitext(file)[1].lower() in (".csv", ".txt", ""):
-        try:
-            with open(file, encoding="Latin") as f:
-                nb_line = sum(1 for _ in f)
-            time.sleep(0.1)
-            with open(file, encoding="Latin") as f:
-                return not (nb_line == sum(1 for _ in f))
-        except (OSError, Exception):
-            return True
-    return False
+            continue
+        with descriptors:
+            for fd in descriptors:
+                try:
+                    target = os.readlink(fd.path)
+                except OSError:
+                    continue
+                if target in targets:
+                    found.add(target)
+        if len(found) == len(targets):
+            break
+    return found
+
+
+def is_file_is_used(file):
+    return files_in_use([file])[file]
+
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+
+
+def iter_closed_files(directory, timeout=None, poll_interval=1.0):
+    """
+    Yield the paths of the files of directory closed after being written
+    (or moved in) since the call, like the files dropped by another
+    process once complete. inotify is used on Linux, else the directory
+    is polled: a file is yielded once its size and modification time
+    didn't change during poll_interval and no process uses it.
+    Examples:
+        >>> for path in iter_closed_files("/data/inbox"):
+        ...     db.insert_many(path, "events")
+    Args:
+        directory: str, the directory watched
+        timeout: float, stop when no file came during timeout seconds,
+            default never
+        poll_interval: float, the seconds between the polls
+
+    Returns:
+        generator of str
+    """
+    watcher = _inotify_closed_files(directory, timeout)
+    if watcher is None:
+        watcher = _poll_closed_files(directory, timeout, poll_interval)
+    yield from watcher
+
+
+def _inotify_closed_files(directory, timeout):
+    try:
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+        )
+        inotify_fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if inotify_fd < 0:
+        return None
+    if libc.inotify_add_watch(
+            inotify_fd, os.fsencode(directory), _IN_CLOSE_WRITE | _IN_MOVED_TO
+    ) < 0:
+        os.close(inotify_fd)
+        return None
+    return _read_inotify(inotify_fd, directory, timeout)
+
+
+def _read_inotify(inotify_fd, directory, timeout):
+    import select
+    import struct
+
+    header = struct.Struct("iIII")
+    try:
+        while True:
+            ready, _, _ = select.select([inotify_fd], [], [], timeout)
+            if not ready:
+                return
+            data = os.read(inotify_fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                _, mask, _, size = header.unpack_from(data, offset)
+                offset += header.size
+                name = data[offset:offset + size].rstrip(b"\0")
+                offset += size
+                if name and mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO):
+                    yield os.path.join(directory, os.fsdecode(name))
+    finally:
+        os.close(inotify_fd)
+
+
+def _poll_closed_files(directory, timeout, poll_interval):
+    def _states():
+        states = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        stat_result = entry.stat()
+                        states[entry.path] = (
+                            stat_result.st_size, stat_result.st_mtime_ns
+                        )
+                except OSError:
+                    pass
+        return states
+
+    known = _states()
+    pending = {}
+    last_file = time.monotonic()
+    while timeout is None or time.monotonic() - last_file < timeout:
+        time.sleep(poll_interval)
+        states = _states()
+        pending = {p: s for p, s in pending.items() if p in states}
+        # unchanged since the last poll: maybe complete
+        stable = [
+            path for path, state in pending.items()
+            if states.get(path) == state
+        ]
+        for path, state in states.items():
+            if known.get(path) != state:
+                pending[path] = state
+        used = files_in_use(stable, stable_delay=0) if stable else {}
+        for path in stable:
+            if not used[path]:
+                pending.pop(path, None)
+                last_file = time.monotonic()
+                yield path
+        known = states
 
 
 def got_error(func):
@@ -653,17 +1655,26 @@ def last_file_lines(fname, N):
     return lines[-N:]
 
 
+_phone_separators_reg = re.compile(r"[\s\-_]")
+_local_phone_reg = re.compile(r"^\d{9,10}$")
+_local_phone_prefixes = ("01", "07", "05", "27", "21", "25")
+_phone_reg = re.compile(
+    r"^((?:00|\+)?[(\[]?(?:00|\+)?\d{1,3}[)\[]?)(\d{8,10})$"
+)
+
+
+_email_reg = re.compile(r"^[\w\-.]+@([\w\-]+\.)+[\w\-]{2,4}$")
+
+
 def is_phone_number(number, retrieve=True, force_plus=True):
-    number = re.sub(r"[\s\-_]", "", str(number))
-    if re.match(r"^\d{9,10}$", number):
+    number = _phone_separators_reg.sub("", str(number))
+    if _local_phone_reg.match(number):
         number = number.zfill(10)
-        if number[:2] in ("01", "07", "05", "27", "21", "25"):
+        if number[:2] in _local_phone_prefixes:
             return True if not retrieve else "+225" + number
         return False if not retrieve else None
 
-    res = re.match(
-        r"^((?:00|\+)?[(\[]?(?:00|\+)?\d{1,3}[)\[]?)(\d{8,10})$", number
-    )
+    res = _phone_reg.match(number)
     if not res:
         return False if not retrieve else None
     suffix, number = res.groups()
@@ -685,8 +1696,50 @@ def is_phone_number(number, retrieve=True, force_plus=True):
     return True if not retrieve else suffix + number
 
 
+def is_phone_number_series(
+        numbers, retrieve=True, force_plus=True, processes=None,
+        chunk_size=200000
+):
+    """
+    is_phone_number applied on each value of a pandas Series (or list),
+    once by distinct value (see map_distinct)
+    Args:
+        numbers: pandas.Series | list
+        retrieve: bool, get the normalized numbers (None for the bad ones)
+            instead of booleans
+        force_plus: bool, see is_phone_number
+        processes: int, the number of processes sharing the distinct
+            values by chunks of chunk_size, default all in the current
+            process
+        chunk_size: int, the number of distinct values by process task
+
+    Returns:
+        pandas.Series (with the index and the name of numbers) | list
+    """
+    return map_distinct(
+        numbers,
+        functools.partial(
+            is_phone_number, retrieve=retrieve, force_plus=force_plus
+        ),
+        null=None if retrieve else False,
+        processes=processes,
+        chunk_size=chunk_size,
+    )
+
+
 def is_email(value: str):
-    return re.match(r"^[\w\-.]+@([\w\-]+\.)+[\w\-]{2,4}$", value) is not None
+    return _email_reg.match(value) is not None
+
+
+def is_email_series(values, processes=None, chunk_size=200000):
+    """
+    is_email of each value of a Series or list (False for the nulls),
+    once by distinct value
+    """
+    return map_distinct(
+        values, is_email, null=False, processes=processes,
+        chunk_size=chunk_size,
+    )
 
 
 if __name__ == "__main__":
@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import codecs
 import csv
 import os
 import re
 import stat
 from builtins import Ellipsis
+from collections import Counter, defaultdict
 from collections.abc import Iterable
 
 import chardet
@@ -15,9 +17,110 @@ import pandas
 import kb_tools.tools as tools
 
 
+def _bigrams(text):
+    return Counter(text[i:i + 2] for i in range(len(text) - 1))
+
+
+class ColumnMatcher:
+    """
+    Find the columns of a dataset matching requested column names, like
+    `tools.Var(column, force=True) == name` with the first matching
+    column: the same name, else the same normalized name, else the first
+    name whose Levenshtein ratio with it is at least eq_ratio.
+    The names are indexed once. The fuzzy candidates are pruned by
+    length and by common bigrams (bounds of the edit distance) before
+    computing the distance.
+    Args:
+        columns: the dataset columns
+        eq_ratio: float, the min Levenshtein ratio of the fuzzy matches
+        eq_dist: int, the min Levenshtein distance of the fuzzy matches
+    """
+
+    def __init__(self, columns, eq_ratio=0.8, eq_dist=1):
+        self.columns = list(columns)
+        self.eq_ratio = eq_ratio
+        self.eq_dist = eq_dist
+        self._exact = {}
+        self._normalized = {}
+        self._keys = []
+        for i, column in enumerate(self.columns):
+            key = tools._normalize_key(column)
+            self._exact.setdefault(str(column), i)
+            self._normalized.setdefault(key, i)
+            self._keys.append(key)
+        # built at the first fuzzy lookup
+        self._lengths = None
+        self._bigrams = None
+        self._found = {}
+
+    def __build_fuzzy_index(self):
+        self._lengths = defaultdict(list)
+        self._bigrams = defaultdict(list)
+        for i, key in enumerate(self._keys):
+            self._lengths[len(key)].append(i)
+            for bigram, count in _bigrams(key).items():
+                self._bigrams[bigram].append((i, count))
+
+    def __max_dist(self, length, other_length):
+        # the max indel distance of a ratio >= eq_ratio
+        return int((1 - self.eq_ratio) * (length + other_length) + 1e-9)
+
+    def __fuzzy(self, key):
+        if self._lengths is None:
+            self.__build_fuzzy_index()
+        size = len(key)
+        common = defaultdict(int)
+        for bigram, count in _bigrams(key).items():
+            for i, other in self._bigrams.get(bigram, ()):
+                common[i] += count if count < other else other
+
+        candidates = []
+        for length, positions in self._lengths.items():
+            max_dist = self.__max_dist(size, length)
+            if abs(length - size) > max_dist:
+                continue
+            # q-gram lemma: k edits remove at most 2k common bigrams
+            need = max(size, length) - 1 - 2 * max_dist
+            candidates.extend(
+                positions if need <= 0 else
+                [i for i in positions if common.get(i, 0) >= need]
+            )
+        for i in sorted(candidates):
+            dist, ratio = tools.lev_calculate(self._keys[i], key)
+            if dist >= (self.eq_dist or 0) and ratio >= self.eq_ratio:
+                return i
+        return None
+
+    def position(self, name):
+        """The position of the column matching name, None if no one"""
+        text = str(name)
+        try:
+            return self._found[text]
+        except KeyError:
+            pass
+        key = tools._normalize_key(text)
+        found = [
+            i for i in (self._exact.get(text), self._normalized.get(key))
+            if i is not None
+        ]
+        i = min(found) if found else self.__fuzzy(key)
+        self._found[text] = i
+        return i
+
+    def find(self, name, default=None):
+        """The column matching name, default if no one"""
+        i = self.position(name)
+        return default if i is None else self.columns[i]
+
+    def __contains__(self, name):
+        return self.position(name) is not None
+
+
 class DatasetFactory:
     is_null = pandas.isnull
     NAN = numpy.nan
+    # min number of rows parsed at once by iter_chunks
+    READ_CSV_CHUNKSIZE = 50000
 
     def __init__(
         self, dataset: str | pandas.DataFrame | list | dict = None, **kwargs
@@ -51,13 +154,9 @@ class DatasetFactory:
     # Ok
     @staticmethod
     def __parse_col(col, columns):
-        for item in columns:
-            if tools.Var(item) == col:
-                return item
-        for item in columns:
-            if tools.Var(item, force=True) == col:
-                return item
-        return col
+        if not isinstance(columns, ColumnMatcher):
+            columns = ColumnMatcher(columns)
+        return columns.find(col, col)
 
     # Ok
 
@@ -68,6 +167,7 @@ class DatasetFactory:
             dataset_columns = [
                 tools.Var(col, force=True) for col in dataset_columns
             ]
+            matcher = ColumnMatcher(dataset_columns)
             first = next(iter(columns))
             without = False
             if first is Ellipsis:
@@ -81,8 +181,8 @@ class DatasetFactory:
                     continue
                 if isinstance(k, dict):
                     k, alias = next(iter(k.items()))
-                if k in dataset_columns:
-                    key = DatasetFactory.__parse_col(k, dataset_columns)
+                if k in matcher:
+                    key = DatasetFactory.__parse_col(k, matcher)
                     alias = (
                         columns[k] if isinstance(columns, dict) else alias or k
                     )
@@ -161,12 +261,11 @@ class DatasetFactory:
                 is_hidden = False
             if is_hidden:
                 dataset = pandas.DataFrame()
-            elif os.path.splitext(file_path)[1][1:].lower() in [
-                "xls",
-                "xlsx",
-                "xlsm",
-                "xlsb",
-            ]:
+            elif cls._is_json_lines_file(file_path):
+                dataset = pandas.DataFrame(
+                    list(tools.iter_json_lines(file_path, cdict=False))
+                )
+            elif cls._is_excel_file(file_path):
                 kwargs_ = {
                     k: v
                     for k, v in kwargs.items()
@@ -283,6 +382,200 @@ class DatasetFactory:
 
         # Ok
 
+    @staticmethod
+    def _is_excel_file(file_path):
+        return os.path.splitext(file_path)[1][1:].lower() in [
+            "xls",
+            "xlsx",
+            "xlsm",
+            "xlsb",
+        ]
+
+    @staticmethod
+    def _is_json_lines_file(file_path):
+        name = file_path.lower()
+        if name.endswith(".gz"):
+            name = name[:-3]
+        return os.path.splitext(name)[1][1:] in ("jsonl", "ndjson")
+
+    @staticmethod
+    def detect_encoding(file_path, sample_size=1 << 20):
+        """
+        Guess the encoding of a file from its first sample_size bytes
+        """
+        with open(file_path, "rb") as file:
+            sample = file.read(sample_size)
+        try:
+            # final=False: the sample can end in the middle of a character
+            codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+            return "utf-8"
+        except UnicodeDecodeError:
+            encoding = chardet.detect(sample).get("encoding") or "latin1"
+            if str(encoding).lower() == "ascii":
+                encoding = "cp1252"
+            return encoding
+
+    @classmethod
+    def is_streamed(cls, data):
+        """
+        Check if iter_chunks reads data by chunks instead of loading it
+        """
+        if isinstance(data, str):
+            return not cls._is_excel_file(data)
+        if hasattr(data, "readable") and data.readable():
+            return True
+        return not (
+            data is None or hasattr(data, "shape") or
+            isinstance(data, (cls, dict, list, tuple))
+        )
+
+    @classmethod
+    def iter_chunks(
+        cls, data, chunksize=10000, sep=None, columns=None, **kwargs
+    ):
+        """
+        Read data by chunks of chunksize rows. The csv files (path or
+        readable object), the JSON Lines files (.jsonl, .ndjson, maybe
+        .gz) and the iterators are streamed: the memory used doesn't
+        depend on the size of the data. The readable objects are read
+        with csv.DictReader like from_file does: the values stay strings.
+        The columns of the JSON Lines chunks are the record keys given in
+        columns, default those of the first chunk: the keys missing in a
+        record give null values, the other keys are ignored.
+        Args:
+            data: file path, readable object, DataFrame, list or iterator
+            chunksize: int, the max number of rows of each chunk
+            sep: str, the csv separator, sniffed when it's not given
+            columns: see from_file
+            **kwargs: pandas.read_csv kwargs, or processes (see
+                tools.iter_json_lines) for the JSON Lines files
+
+        Returns:
+            generator of pandas.DataFrame
+        """
+        delimiters = kwargs.pop("delimiters", None)
+        kwargs.pop("force_encoding", None)
+        if "header" in kwargs and isinstance(kwargs["header"], bool):
+            kwargs["header"] = None if not kwargs["header"] else "infer"
+        if isinstance(data, cls):
+            data = data.dataset
+        if isinstance(data, str) and cls._is_json_lines_file(data):
+            names = None
+            if isinstance(columns, dict) or (
+                    isinstance(columns, (list, tuple)) and
+                    all(isinstance(c, str) for c in columns)
+            ):
+                names = list(columns)
+            for records in tools.iter_json_lines(
+                    data, batch_size=max(int(chunksize), 1), cdict=False,
+                    processes=kwargs.get("processes")
+            ):
+                chunk = pandas.DataFrame(records, columns=names)
+                names = list(chunk.columns)
+                yield cls(chunk, columns=columns).dataset
+            return
+        kwargs.pop("processes", None)
+        if hasattr(data, "readable") and data.readable():
+            # like from_file: read with csv.DictReader, the values are kept
+            # as strings
+            kk = {}
+            if sep is None:
+                sample = [data.readline() for _ in range(10)]
+                data.seek(0)
+                try:
+                    sep = cls._check_delimiter(
+                        sample, delimiters, need_cols=columns
+                    )
+                except csv.Error:
+                    sep = None
+            if sep:
+                kk["delimiter"] = sep
+            for rows in tools.get_buffer(
+                    csv.DictReader(data, **kk), chunksize, vv=False
+            ):
+                yield cls(pandas.DataFrame(rows), columns=columns).dataset
+            return
+        if isinstance(data, str) and not cls._is_excel_file(data):
+            kwargs_ = {
+                k: v
+                for k, v in kwargs.items()
+                if k in tools.get_func_args(pandas.read_csv)
+            }
+            kwargs_.pop("chunksize", None)
+            kwargs_.pop("iterator", None)
+            # the encoding can't change once the first chunks are used
+            if kwargs_.get("encoding") is None:
+                kwargs_["encoding"] = cls.detect_encoding(data)
+            if sep is None:
+                with open(
+                    data, encoding=kwargs_["encoding"], errors="replace"
+                ) as file:
+                    sample = [file.readline() for _ in range(10)]
+                try:
+                    sep = cls._check_delimiter(
+                        sample, delimiters, need_cols=columns
+                    )
+                except csv.Error:
+                    sep = None
+            if sep:
+                kwargs_["sep"] = sep
+            chunksize = max(int(chunksize), 1)
+            with pandas.read_csv(
+                data, chunksize=max(chunksize, cls.READ_CSV_CHUNKSIZE),
+                **kwargs_
+            ) as reader:
+                for chunk in reader:
+                    yield from tools.get_buffer(
+                        cls(chunk, columns=columns).dataset, chunksize,
+                        vv=False
+                    )
+            return
+        if not cls.is_streamed(data):
+            dataset = cls(data, sep=sep, columns=columns, **kwargs).dataset
+            # positional views of the loaded dataset
+            yield from tools.get_buffer(dataset, chunksize, vv=False)
+            return
+        for chunk in tools.get_buffer(data, chunksize, vv=False):
+            yield cls.from_file(chunk, columns=columns, **kwargs).dataset
+
+    @staticmethod
+    def to_rows(dataset: pandas.DataFrame):
+        """
+        Convert the dataset in a list of tuples (one by row) of python
+        objects, the null values (NaN, NaT, NA) becoming None.
+        The conversion is made column by column: the null mask is computed
+        once and the numpy values converted with tolist.
+        """
+        if not dataset.shape[1]:
+            return [() for _ in range(dataset.shape[0])]
+        columns = []
+        for _, column in dataset.items():
+            dtype = column.dtype
+            if isinstance(dtype, numpy.dtype) and dtype.kind in "biu":
+                # no null value possible
+                columns.append(column.to_numpy().tolist())
+                continue
+            if isinstance(dtype, numpy.dtype) and dtype.kind == "f":
+                values = column.to_numpy()
+                mask = numpy.isnan(values)
+                values = values.tolist()
+            elif dtype.kind == "M":
+                mask = column.isna().to_numpy()
+                values = column.dt.to_pydatetime().tolist()
+            else:
+                mask = column.isna().to_numpy()
+                # the numpy scalars of the object columns (lists of dicts,
+                # mixed columns) as python values: sqlite3 stores a
+                # numpy.int64 as a blob
+                values = [
+                    v.item() if isinstance(v, numpy.generic) else v
+                    for v in column.to_numpy(dtype=object).tolist()
+                ]
+            for i in numpy.flatnonzero(mask).tolist():
+                values[i] = None
+            columns.append(values)
+        return list(zip(*columns))
+
     def save(self, path=None, force=False, chdir=True, **kwargs):
         path = path or self.__path
 